@@ -0,0 +1,97 @@
+import argparse
+import datetime
+import random
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from history_columns import HistoryColumns, export_columns
+from messages import HISTORY_DATETIME_FORMAT, parse_line, split_line
+
+WORDS = 'привет как дела что нового кто в игре пошли строить шахту алмазы нашёл крипер взорвал дом ok lol gg'.split()
+LINES_PER_MINUTE = 1000
+
+
+def generate_history(filepath, size, nicknames_count=1000, chunk_lines=100000):
+    nicknames = [f'player{number}' for number in range(nicknames_count)]
+    texts = [' '.join(random.choices(WORDS, k=random.randint(2, 12))) for _ in range(10000)]
+    minute = datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(days=365)
+    written = 0
+    lines_count = 0
+    with open(filepath, 'wb') as history_file:
+        while written < size:
+            lines = []
+            for _ in range(chunk_lines // LINES_PER_MINUTE):
+                stamp = f'[{minute:{HISTORY_DATETIME_FORMAT}}] '
+                lines.extend(
+                    f'{stamp}{random.choice(nicknames)}: {random.choice(texts)}\n'
+                    for _ in range(LINES_PER_MINUTE)
+                )
+                minute += datetime.timedelta(minutes=1)
+            chunk = ''.join(lines).encode()
+            history_file.write(chunk)
+            written += len(chunk)
+            lines_count += len(lines)
+    return lines_count
+
+
+def measure(name, func, size):
+    started_at = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started_at
+    print(f'{name}: {elapsed:.2f} s, {size / elapsed / 1024 / 1024:.0f} MB/s')
+    return result
+
+
+def parse_history(history_file):
+    with open(history_file, 'rb') as lines:
+        return sum(1 for line in lines if parse_line(line).nickname)
+
+
+def count_nicknames_in_text(history_file):
+    with open(history_file, 'rb') as lines:
+        return Counter(split_line(line.rstrip(b'\n'))[1] for line in lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark history parsing and columnar export')
+    parser.add_argument('--size', '-s', type=int, default=512, help='Generated history size, MB')
+    parser.add_argument('--historyfile', '-f', help='Use existing history file instead of generating one')
+    parser.add_argument('--workdir', '-w', help='Directory for generated files, temporary by default')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        history_file = Path(args.historyfile or Path(workdir) / 'bench.history')
+        if not args.historyfile:
+            lines_count = measure(
+                'Generate',
+                lambda: generate_history(history_file, args.size * 1024 * 1024),
+                args.size * 1024 * 1024
+            )
+            print(f'    {lines_count} lines')
+        size = history_file.stat().st_size
+
+        measure('Parse into Message records', lambda: parse_history(history_file), size)
+        measure('Count nicknames scanning text', lambda: count_nicknames_in_text(history_file), size)
+
+        columns_dir = Path(workdir) / 'bench.columns'
+        with open(history_file, 'rb') as lines:
+            rows = measure('Export to columns', lambda: export_columns(lines, columns_dir), size)
+        columns_size = sum(path.stat().st_size for path in columns_dir.iterdir())
+        print(f'    {rows} rows, {columns_size / 1024 / 1024:.0f} MB on disk')
+
+        with HistoryColumns(columns_dir) as history_columns:
+            counts = measure('Count nicknames scanning columns', history_columns.count_by_nickname, size)
+            print(f'    {len(counts)} nicknames')
+            last_timestamp = history_columns.timestamps[-1]
+            found_rows = measure(
+                'Find last day of messages',
+                lambda: history_columns.find_rows(since=last_timestamp - 24 * 60 * 60),
+                size
+            )
+            print(f'    {len(found_rows)} rows, last: {history_columns.get_message(found_rows[-1])}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import logging
+import resource
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import anyio
+
+import minechat
+from fake_server import FakeChatServer, generate_messages
+from history import HistoryWriter
+from queues import BoundedQueue, QueuePolicy
+
+
+class ClientStats:
+    def __init__(self):
+        self.received = 0
+        self.broadcast_latencies = []
+        self.round_trip_latencies = []
+        self.render_times = []
+        self.queues = []
+
+
+def parse_sent_at(message):
+    try:
+        return float(message.rsplit(' ', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+async def consume_messages(messages_queue, stats, panel=None, history_paging=None):
+    while True:
+        message = await messages_queue.get()
+        batch = [message]
+        while not messages_queue.empty():
+            batch.append(messages_queue.get_nowait())
+
+        received_at = time.perf_counter()
+        for message in batch:
+            sent_at = parse_sent_at(message)
+            if sent_at is None:
+                continue
+            stats.received += 1
+            latencies = stats.broadcast_latencies if message.startswith('Bot:') else stats.round_trip_latencies
+            latencies.append(received_at - sent_at)
+
+        if panel:
+            import gui_main
+
+            render_started_at = time.perf_counter()
+            gui_main.render_messages(panel, batch, history_paging)
+            panel.update_idletasks()
+            stats.render_times.append(time.perf_counter() - render_started_at)
+
+
+async def send_periodically(sending_queue, rate, client_number):
+    while True:
+        sending_queue.put_nowait(f'client {client_number} {time.perf_counter()}')
+        await anyio.sleep(1 / rate)
+
+
+async def drain_queue(queue):
+    while True:
+        await queue.get()
+
+
+async def run_client(
+    config,
+    client_number,
+    send_rate,
+    history_file,
+    stats,
+    queue_size,
+    panel=None,
+    history_paging=None
+):
+    messages_queue = BoundedQueue('messages', queue_size, QueuePolicy.DROP_OLDEST)
+    sending_queue = asyncio.Queue()
+    history_queue = BoundedQueue('history', queue_size)
+    stats.queues = [messages_queue, history_queue]
+    status_updates_queue = asyncio.Queue()
+    watchdog_queue = asyncio.Queue()
+
+    async with HistoryWriter(history_file, indexed=False) as history_writer:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(consume_messages, messages_queue, stats, panel, history_paging)
+            tg.start_soon(minechat.save_messages, history_writer, history_queue)
+            tg.start_soon(drain_queue, status_updates_queue)
+            tg.start_soon(drain_queue, watchdog_queue)
+            if send_rate:
+                tg.start_soon(send_periodically, sending_queue, send_rate, client_number)
+            tg.start_soon(
+                minechat.handle_connection,
+                config,
+                messages_queue,
+                sending_queue,
+                history_queue,
+                status_updates_queue,
+                watchdog_queue
+            )
+
+
+def format_percentiles(latencies):
+    if len(latencies) < 2:
+        return 'no data'
+    latencies_ms = [latency * 1000 for latency in latencies]
+    percentiles = statistics.quantiles(latencies_ms, n=100)
+    return f'p50 {percentiles[49]:.2f} ms, p95 {percentiles[94]:.2f} ms, p99 {percentiles[98]:.2f} ms'
+
+
+def create_panel():
+    import tkinter as tk
+    from tkinter.scrolledtext import ScrolledText
+
+    import gui_main
+
+    root = tk.Tk()
+    panel = ScrolledText(root, wrap='none')
+    panel.pack(fill='both', expand=True)
+    history_paging = gui_main.create_history_paging(5000, 20000, 500)
+    history_paging['exhausted'] = True
+    return panel, history_paging
+
+
+async def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(description='Benchmark chat client pipeline against a local fake server')
+    parser.add_argument('--clients', '-c', type=int, default=10, help='Clients count')
+    parser.add_argument('--rate', '-r', type=float, default=1000, help='Server broadcast messages per second')
+    parser.add_argument('--sendrate', '-sr', type=float, default=5, help='Messages per second sent by each client')
+    parser.add_argument('--duration', '-d', type=float, default=10, help='Benchmark duration, seconds')
+    parser.add_argument('--queuesize', '-q', type=int, default=10000, help='Messages and history queues size')
+    parser.add_argument('--gui', action='store_true', help='Render messages of the first client in Tk panel')
+    args = parser.parse_args()
+
+    server = FakeChatServer()
+    await server.start()
+    config = {
+        'host': server.host,
+        'reading_host': server.host,
+        'reading_port': server.reading_port,
+        'writing_port': server.writing_port,
+        'send_rate': max(args.sendrate * 2, 1),
+        'send_burst': 100,
+        'ping_interval': 5,
+        'reconnect_base_delay': 0.5,
+        'reconnect_stable_time': 0,
+        'reading_timeout': 0,
+        'small_reconnect_timeout': 3,
+        'big_reconnect_timeout': 10,
+        'replay_window': 1000,
+    }
+
+    clients_stats = [ClientStats() for _ in range(args.clients)]
+    panel, history_paging = create_panel() if args.gui else (None, None)
+    with tempfile.TemporaryDirectory() as history_dir:
+        async with anyio.create_task_group() as tg:
+            for client_number, stats in enumerate(clients_stats):
+                client_config = {**config, 'token': server.register(f'client{client_number}')['account_hash']}
+                tg.start_soon(
+                    run_client,
+                    client_config,
+                    client_number,
+                    args.sendrate,
+                    Path(history_dir) / f'client{client_number}.history',
+                    stats,
+                    args.queuesize,
+                    panel if client_number == 0 else None,
+                    history_paging
+                )
+            await anyio.sleep(1)
+            tg.start_soon(generate_messages, server, args.rate, 'Bot', lambda: str(time.perf_counter()))
+            await anyio.sleep(args.duration)
+            tg.cancel_scope.cancel()
+
+        history_lines = sum(
+            len(history_file.read_bytes().splitlines())
+            for history_file in Path(history_dir).glob('*.history')
+        )
+    await server.stop()
+
+    received = sum(stats.received for stats in clients_stats)
+    print(f'Clients: {args.clients}, broadcast rate: {args.rate:.0f} msg/s, send rate: {args.sendrate:.1f} msg/s')
+    print(f'Received: {received / args.duration:.0f} msg/s over all clients')
+    print(f'Messages accepted by server: {server.received_count / args.duration:.1f} msg/s')
+    print(f'History lines written: {history_lines / args.duration:.0f} lines/s')
+    print(f'Broadcast latency: {format_percentiles(sum((s.broadcast_latencies for s in clients_stats), []))}')
+    print(f'Send round trip: {format_percentiles(sum((s.round_trip_latencies for s in clients_stats), []))}')
+    if args.gui:
+        render_times = clients_stats[0].render_times
+        print(f'Render: {format_percentiles(render_times)}, worst {max(render_times) * 1000:.2f} ms')
+    for queue_number, queue_name in enumerate(('Messages', 'History')):
+        queues = [stats.queues[queue_number] for stats in clients_stats]
+        print(
+            f'{queue_name} queue: high water {max(queue.high_water for queue in queues)}, '
+            f'dropped {sum(queue.dropped for queue in queues)}'
+        )
+    print(f'Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    anyio.run(main)
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import anyio
+
+import events
+import minechat
+from chat_protocol import address_cache
+from fake_server import FakeChatServer, generate_messages
+
+
+async def wait_for_status(status_updates_queue, expected_status):
+    while await status_updates_queue.get() != expected_status:
+        pass
+
+
+async def wait_for_message(messages_queue, expected_text=''):
+    while not messages_queue.empty():
+        messages_queue.get_nowait()
+    while expected_text not in await messages_queue.get():
+        pass
+
+
+async def drain_queue(queue):
+    while True:
+        await queue.get()
+
+
+async def measure_recovery(server, messages_queue, sending_queue, status_updates_queue, drop_number):
+    await wait_for_status(status_updates_queue, events.SendingConnectionStateChanged.ESTABLISHED)
+    dropped_at = time.perf_counter()
+    server.drop_connections()
+
+    await wait_for_message(messages_queue)
+    reading_recovered_at = time.perf_counter()
+
+    sending_queue.put_nowait(f'bench {drop_number}')
+    await wait_for_message(messages_queue, f'bench {drop_number}')
+    sending_recovered_at = time.perf_counter()
+    return reading_recovered_at - dropped_at, sending_recovered_at - dropped_at
+
+
+async def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(description='Measure chat recovery time after dropped connections')
+    parser.add_argument('--drops', '-d', type=int, default=20, help='Connection drops count')
+    parser.add_argument('--rate', '-r', type=float, default=100, help='Server messages per second')
+    parser.add_argument('--host', '-s', help='Host name the client connects to, e.g. localhost to use DNS')
+    args = parser.parse_args()
+
+    server = FakeChatServer()
+    await server.start()
+    token = server.register('bench')['account_hash']
+    config = {
+        'host': args.host or server.host,
+        'reading_host': args.host or server.host,
+        'reading_port': server.reading_port,
+        'writing_port': server.writing_port,
+        'token': token,
+        'send_rate': 1000,
+        'send_burst': 100,
+        'ping_interval': 5,
+        'reconnect_base_delay': 0.5,
+        'reconnect_stable_time': 0,
+        'reading_timeout': 0,
+        'small_reconnect_timeout': 3,
+        'big_reconnect_timeout': 10,
+        'replay_window': 0,
+    }
+    for host, port in ((config['reading_host'], config['reading_port']), (config['host'], config['writing_port'])):
+        await address_cache.resolve(host, port)
+    messages_queue = asyncio.Queue()
+    sending_queue = asyncio.Queue()
+    history_queue = asyncio.Queue()
+    status_updates_queue = asyncio.Queue()
+    watchdog_queue = asyncio.Queue()
+
+    reading_times = []
+    sending_times = []
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(generate_messages, server, args.rate)
+        tg.start_soon(drain_queue, history_queue)
+        tg.start_soon(drain_queue, watchdog_queue)
+        tg.start_soon(
+            minechat.handle_connection,
+            config,
+            messages_queue,
+            sending_queue,
+            history_queue,
+            status_updates_queue,
+            watchdog_queue
+        )
+        for drop_number in range(args.drops):
+            reading_time, sending_time = await measure_recovery(
+                server,
+                messages_queue,
+                sending_queue,
+                status_updates_queue,
+                drop_number
+            )
+            reading_times.append(reading_time * 1000)
+            sending_times.append(sending_time * 1000)
+        tg.cancel_scope.cancel()
+    await server.stop()
+
+    for name, times in (('Reading', reading_times), ('Sending', sending_times)):
+        print(
+            f'{name} recovery: median {statistics.median(times):.1f} ms, '
+            f'min {min(times):.1f} ms, max {max(times):.1f} ms'
+        )
+
+
+if __name__ == '__main__':
+    anyio.run(main)
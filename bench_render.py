@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import time
+import tkinter as tk
+from tkinter.scrolledtext import ScrolledText
+
+import gui_main
+
+
+def run_benchmark(messages_count, max_batch_size, scrollback_lines):
+    root = tk.Tk()
+    panel = ScrolledText(root, wrap='none')
+    panel.pack(fill='both', expand=True)
+    root.update()
+
+    messages_queue = asyncio.Queue()
+    for number in range(messages_count):
+        messages_queue.put_nowait(f'[bench] Сообщение номер {number}')
+    history_paging = gui_main.create_history_paging(scrollback_lines, scrollback_lines, max_batch_size)
+    history_paging['exhausted'] = True
+
+    frame_times = []
+    started_at = time.perf_counter()
+    while not messages_queue.empty():
+        frame_started_at = time.perf_counter()
+        msg = messages_queue.get_nowait()
+        batch = gui_main.take_messages_batch(messages_queue, msg, max_batch_size)
+        gui_main.render_messages(panel, batch, history_paging)
+        root.update()
+        frame_times.append(time.perf_counter() - frame_started_at)
+    elapsed = time.perf_counter() - started_at
+    root.destroy()
+
+    print(f'Messages: {messages_count}, batch size: {max_batch_size}, scrollback: {scrollback_lines}')
+    print(f'Frames: {len(frame_times)}')
+    print(f'Rendered: {messages_count / elapsed:.0f} messages/s')
+    print(f'Worst frame: {max(frame_times) * 1000:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark conversation panel rendering')
+    parser.add_argument('--messages', '-m', type=int, default=100_000, help='Messages count')
+    parser.add_argument('--batchsize', '-b', type=int, default=500, help='Max messages per frame')
+    parser.add_argument('--scrollback', '-l', type=int, default=5000, help='Scrollback lines')
+    args = parser.parse_args()
+
+    run_benchmark(args.messages, args.batchsize, args.scrollback)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import logging
+import re
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+import anyio
+
+import minechat
+from fake_server import FakeChatServer, generate_messages
+from history import HistoryWriter
+
+
+async def drop_connections(server, drops, interval, gap_every):
+    for drop_number in range(1, drops + 1):
+        await anyio.sleep(interval)
+        if gap_every and not drop_number % gap_every:
+            server.backlog.clear()
+        server.drop_connections()
+
+
+def check_history(history_file):
+    numbers = Counter(
+        int(match.group(1))
+        for line in history_file.read_text(encoding='utf-8').splitlines()
+        if (match := re.search(r'сообщение номер (\d+)$', line))
+    )
+    duplicates = sum(count - 1 for count in numbers.values())
+    missing = set(range(min(numbers), max(numbers) + 1)) - set(numbers) if numbers else set()
+    return sum(numbers.values()), duplicates, len(missing)
+
+
+async def main():
+    logging.basicConfig(level=logging.ERROR)
+
+    parser = argparse.ArgumentParser(description='Check replay deduplication against a fake server with backlog')
+    parser.add_argument('--drops', '-d', type=int, default=20, help='Connection drops count')
+    parser.add_argument('--interval', '-i', type=float, default=0.2, help='Seconds between drops')
+    parser.add_argument('--rate', '-r', type=float, default=200, help='Server messages per second')
+    parser.add_argument('--backlog', '-b', type=int, default=100, help='Messages replayed by server on connect')
+    parser.add_argument('--window', '-w', type=int, default=1000, help='Replay filter window, 0 to disable')
+    parser.add_argument('--gapevery', '-g', type=int, default=0, help='Clear server backlog on every N-th drop')
+    args = parser.parse_args()
+
+    server = FakeChatServer(backlog_size=args.backlog)
+    await server.start()
+    config = {
+        'host': server.host,
+        'reading_host': server.host,
+        'reading_port': server.reading_port,
+        'writing_port': server.writing_port,
+        'token': server.register('replay')['account_hash'],
+        'send_rate': 5,
+        'send_burst': 10,
+        'ping_interval': 5,
+        'reconnect_base_delay': 0.05,
+        'reconnect_stable_time': 0,
+        'reading_timeout': 0,
+        'small_reconnect_timeout': 3,
+        'big_reconnect_timeout': 1,
+        'replay_window': args.window,
+    }
+    messages_queue = asyncio.Queue()
+    history_queue = asyncio.Queue()
+    gap_notices = 0
+
+    with tempfile.TemporaryDirectory() as history_dir:
+        history_file = Path(history_dir) / 'replay.history'
+        async with HistoryWriter(history_file, indexed=False) as history_writer:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(minechat.save_messages, history_writer, history_queue)
+                tg.start_soon(
+                    minechat.handle_connection,
+                    config,
+                    messages_queue,
+                    asyncio.Queue(),
+                    history_queue,
+                    asyncio.Queue(),
+                    asyncio.Queue()
+                )
+                tg.start_soon(generate_messages, server, args.rate)
+                await drop_connections(server, args.drops, args.interval, args.gapevery)
+                await anyio.sleep(args.interval)
+                tg.cancel_scope.cancel()
+
+        while not messages_queue.empty():
+            if 'могла быть пропущена' in messages_queue.get_nowait():
+                gap_notices += 1
+        written, duplicates, missing = check_history(history_file)
+    await server.stop()
+
+    print(f'Drops: {args.drops}, backlog: {args.backlog}, window: {args.window}')
+    print(f'Written: {written}, duplicates: {duplicates}, missing: {missing}, gap notices: {gap_notices}')
+
+    failed = False
+    if args.window and duplicates:
+        print(f'    {duplicates} duplicates with replay filter on')
+        failed = True
+    if args.gapevery and args.drops >= args.gapevery and not gap_notices:
+        print('    no gap notices after backlog was cleared')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    anyio.run(main)
@@ -0,0 +1,66 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = ['send_message.py', 'read_chat.py', 'read_daemon.py', 'search_history.py', 'main.py']
+HEADLESS_ENTRY_POINTS = {'send_message.py', 'read_chat.py', 'read_daemon.py', 'search_history.py'}
+GUI_MODULES = {'tkinter', '_tkinter', 'gui_main', 'gui_reg'}
+
+
+def parse_importtime(output):
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative_time, module = line.removeprefix('import time:').split('|', 2)
+        imports.append((int(cumulative_time), int(self_time), module[1:].rstrip()))
+    return imports
+
+
+def measure_startup(script, runs):
+    wall_times = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, script, '--help'], stdout=subprocess.DEVNULL, check=True)
+        wall_times.append((time.perf_counter() - started_at) * 1000)
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', script, '--help'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True
+    )
+    return statistics.median(wall_times), parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start time of entry points')
+    parser.add_argument('scripts', nargs='*', default=ENTRY_POINTS, help='Entry points')
+    parser.add_argument('--runs', '-r', type=int, default=5, help='Runs per entry point')
+    parser.add_argument('--top', '-t', type=int, default=5, help='Slowest top-level imports to show')
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    print(f'Bare interpreter: {(time.perf_counter() - started_at) * 1000:.0f} ms')
+
+    failed = False
+    for script in args.scripts:
+        wall_time, imports = measure_startup(script, args.runs)
+        modules = {module.strip() for _, _, module in imports}
+        gui_modules = modules & GUI_MODULES
+        print(f'{script}: {wall_time:.0f} ms, {len(modules)} modules')
+        top_level = sorted((item for item in imports if not item[2].startswith('  ')), reverse=True)
+        for cumulative_time, _, module in top_level[:args.top]:
+            print(f'    {module.strip():<30} {cumulative_time / 1000:.1f} ms')
+        if script in HEADLESS_ENTRY_POINTS and gui_modules:
+            print(f'    loads GUI modules: {", ".join(sorted(gui_modules))}')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
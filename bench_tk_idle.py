@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import statistics
+import time
+import tkinter as tk
+from tkinter.scrolledtext import ScrolledText
+
+import anyio
+
+import gui_main
+
+
+class TimedScrolledText(ScrolledText):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def insert(self, index, chars, *args):
+        super().insert(index, chars, *args)
+        sent_times = [float(line.split()[-1]) for line in chars.split('\n') if line.startswith('bench')]
+        self.after_idle(self.record_latencies, sent_times)
+
+    def record_latencies(self, sent_times):
+        now = time.perf_counter()
+        self.latencies.extend(now - sent_at for sent_at in sent_times)
+
+
+async def send_messages_slowly(messages_queue, messages_count, interval):
+    for _ in range(messages_count):
+        messages_queue.put_nowait(f'bench {time.perf_counter()}')
+        await anyio.sleep(interval)
+    await anyio.sleep(interval)
+
+
+async def measure(mode, idle_duration, messages_count):
+    root = tk.Tk()
+    root_frame = tk.Frame(root)
+    root_frame.pack(fill='both', expand=True)
+    panel = TimedScrolledText(root_frame, wrap='none')
+    panel.pack(fill='both', expand=True)
+
+    messages_queue = asyncio.Queue()
+    history_paging = gui_main.create_history_paging(5000, 5000, 500)
+    history_paging['exhausted'] = True
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(gui_main.update_tk, root_frame, mode)
+        tg.start_soon(gui_main.update_conversation_history, panel, messages_queue, history_paging, mode)
+
+        await anyio.sleep(1)
+        cpu_started_at = time.process_time()
+        await anyio.sleep(idle_duration)
+        idle_cpu = (time.process_time() - cpu_started_at) / idle_duration
+
+        await send_messages_slowly(messages_queue, messages_count, interval=0.1)
+        tg.cancel_scope.cancel()
+    root.destroy()
+
+    latencies_ms = sorted(latency * 1000 for latency in panel.latencies)
+    print(f'Mode: {mode.value}')
+    print(f'  Idle CPU: {idle_cpu * 100:.2f} %')
+    print(f'  Latency median: {statistics.median(latencies_ms):.2f} ms, max: {latencies_ms[-1]:.2f} ms')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Measure idle CPU and message-to-screen latency of Tk updates')
+    parser.add_argument('--idle', '-i', type=float, default=10, help='Idle measurement duration, seconds')
+    parser.add_argument('--messages', '-m', type=int, default=50, help='Messages for latency measurement')
+    args = parser.parse_args()
+
+    for mode in gui_main.TkUpdateMode:
+        await measure(mode, args.idle, args.messages)
+
+
+if __name__ == '__main__':
+    anyio.run(main)
@@ -0,0 +1,289 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import random
+import socket
+import time
+from contextlib import asynccontextmanager
+from itertools import zip_longest
+from pathlib import Path
+
+logger = logging.getLogger('chat_protocol')
+
+READ_CHUNK_SIZE = 64 * 1024
+DNS_CACHE_TTL = 300
+HAPPY_EYEBALLS_DELAY = 0.25
+PREWARMED_CONNECTION_TTL = 30
+STABLE_CONNECTION_TIME = 5
+KEEPALIVE_OPTIONS = {
+    'TCP_KEEPIDLE': 10,
+    'TCP_KEEPINTVL': 5,
+    'TCP_KEEPCNT': 3,
+}
+
+
+class Backoff:
+    def __init__(self, base_delay=0.5, max_delay=30, stable_time=STABLE_CONNECTION_TIME):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stable_time = stable_time
+        self.attempt = 0
+        self.connected_at = None
+
+    def mark_connected(self):
+        self.connected_at = time.monotonic()
+
+    def next_delay(self):
+        if self.connected_at is not None and time.monotonic() - self.connected_at >= self.stable_time:
+            self.attempt = 0
+        self.connected_at = None
+        if self.attempt:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (self.attempt - 1)))
+        else:
+            delay = 0
+        self.attempt += 1
+        return delay
+
+
+class AddressCache:
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.lookups = {}
+
+    async def lookup(self, host, port):
+        loop = asyncio.get_running_loop()
+        address_infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        self.entries[(host, port)] = (time.monotonic(), interleave_families(address_infos))
+        return self.entries[(host, port)][1]
+
+    def start_lookup(self, host, port):
+        key = (host, port)
+        if key not in self.lookups:
+            lookup = asyncio.create_task(self.lookup(host, port))
+            lookup.add_done_callback(lambda task: self.finish_lookup(key, task))
+            self.lookups[key] = lookup
+        return self.lookups[key]
+
+    def finish_lookup(self, key, task):
+        del self.lookups[key]
+        if not task.cancelled() and task.exception() and key in self.entries:
+            logger.info(f'Using stale addresses of {key[0]}: {task.exception()!r}')
+
+    async def resolve(self, host, port):
+        entry = self.entries.get((host, port))
+        if not entry and is_ip_address(host):
+            address_infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_NUMERICHOST)
+            self.entries[(host, port)] = (float('inf'), address_infos)
+            return address_infos
+        if not entry:
+            return await asyncio.shield(self.start_lookup(host, port))
+        resolved_at, address_infos = entry
+        if time.monotonic() - resolved_at >= self.ttl:
+            self.start_lookup(host, port)
+        return address_infos
+
+    def expire(self, host, port):
+        if (host, port) in self.entries:
+            self.entries[(host, port)] = (float('-inf'), self.entries[(host, port)][1])
+
+
+address_cache = AddressCache()
+prewarmed_connections = {}
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def interleave_families(address_infos):
+    families = {}
+    for address_info in address_infos:
+        families.setdefault(address_info[0], []).append(address_info)
+    return [
+        address_info
+        for group in zip_longest(*families.values())
+        for address_info in group
+        if address_info
+    ]
+
+
+def enable_keepalive(sock):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in KEEPALIVE_OPTIONS.items():
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+async def connect_socket(address_info):
+    family, socket_type, proto, _, address = address_info
+    sock = socket.socket(family, socket_type, proto)
+    try:
+        sock.setblocking(False)
+        enable_keepalive(sock)
+        await asyncio.get_running_loop().sock_connect(sock, address)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def connect_happy_eyeballs(address_infos, delay=HAPPY_EYEBALLS_DELAY):
+    remaining = list(address_infos)
+    attempts = []
+    pending = set()
+    errors = []
+    connected_socket = None
+    try:
+        while remaining or pending:
+            if remaining:
+                attempt = asyncio.create_task(connect_socket(remaining.pop(0)))
+                attempts.append(attempt)
+                pending.add(attempt)
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for attempt in done:
+                if attempt.exception():
+                    errors.append(attempt.exception())
+                elif not connected_socket:
+                    connected_socket = attempt.result()
+            if connected_socket:
+                return connected_socket
+    finally:
+        for attempt in attempts:
+            if not attempt.done():
+                attempt.cancel()
+            elif not attempt.cancelled() and not attempt.exception() and attempt.result() is not connected_socket:
+                attempt.result().close()
+    if len(errors) == 1:
+        raise errors[0]
+    raise OSError(f'Multiple exceptions: {", ".join(str(error) for error in errors)}')
+
+
+async def open_connection(host, port):
+    address_infos = await address_cache.resolve(host, port)
+    try:
+        sock = await connect_happy_eyeballs(address_infos)
+    except OSError:
+        address_cache.expire(host, port)
+        raise
+    return await asyncio.open_connection(sock=sock)
+
+
+def prewarm_connection(host, port, ttl=PREWARMED_CONNECTION_TTL):
+    key = (host, port)
+    if key in prewarmed_connections:
+        return prewarmed_connections[key]
+    logger.debug(f'Prewarming connection to {host}:{port}')
+    connecting = asyncio.create_task(open_connection(host, port))
+    connecting.add_done_callback(lambda task: task.cancelled() or task.exception())
+    prewarmed_connections[key] = connecting
+    asyncio.get_running_loop().call_later(ttl, discard_prewarmed_connection, key, connecting)
+    return connecting
+
+
+def discard_prewarmed_connection(key, connecting):
+    if prewarmed_connections.get(key) is not connecting:
+        return
+    del prewarmed_connections[key]
+    if not connecting.done():
+        connecting.cancel()
+    elif not connecting.cancelled() and not connecting.exception():
+        _, writer = connecting.result()
+        writer.close()
+
+
+async def take_prewarmed_connection(host, port):
+    connecting = prewarmed_connections.pop((host, port), None)
+    if not connecting or connecting.cancelled():
+        return None
+    try:
+        reader, writer = await connecting
+    except OSError:
+        return None
+    if reader.at_eof():
+        writer.close()
+        return None
+    return reader, writer
+
+
+@asynccontextmanager
+async def get_connection(host, port):
+    reader, writer = await take_prewarmed_connection(host, port) or await open_connection(host, port)
+    try:
+        yield reader, writer
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def read_lines(reader, chunk_size=READ_CHUNK_SIZE):
+    tail = b''
+    while chunk := await reader.read(chunk_size):
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        if lines:
+            yield lines
+    if tail:
+        yield [tail]
+
+
+async def receive_credentials(reader):
+    credentials_response = await reader.readline()
+    credentials = json.loads(credentials_response.decode().strip())
+    logger.info(f'Received {credentials}')
+    return credentials
+
+
+async def save_token(nickname, token):
+    import aiofiles
+
+    token_path = Path(f'{nickname}.token')
+    if token_path.exists():
+        async with aiofiles.open(token_path) as tokenfile:
+            if await tokenfile.read() == token:
+                return
+    async with aiofiles.open(token_path, 'w') as tokenfile:
+        await tokenfile.write(token)
+
+
+async def sign_in(reader, writer, token):
+    logger.info(f'Sending "{token}"')
+    await write_to_chat(writer, f'{token}\n')
+    return await receive_credentials(reader)
+
+
+async def sign_up(reader, writer, nickname, send_blank=False):
+    nickname_query = await reader.readline()
+    logger.info(nickname_query.decode().strip())
+    if send_blank:
+        await write_to_chat(writer, '\n')
+        nickname_query = await reader.readline()
+        logger.info(nickname_query.decode().strip())
+    logger.info(f'Sending "{nickname}"')
+    await write_to_chat(writer, f'{nickname}\n')
+    return await receive_credentials(reader)
+
+
+async def submit_message(writer, message):
+    message = message.replace('\n', ' ')
+    await write_to_chat(writer, f'{message}\n\n')
+
+
+async def submit_messages(writer, messages):
+    lines = (message.replace('\n', ' ') for message in messages)
+    writer.write(''.join(f'{line}\n\n' for line in lines).encode())
+    await writer.drain()
+
+
+async def write_to_chat(writer, message):
+    writer.write(message.encode())
+    await writer.drain()
@@ -0,0 +1,220 @@
+import base64
+import datetime
+import heapq
+import json
+import time
+import zlib
+from array import array
+from collections import Counter
+from hashlib import blake2b
+from pathlib import Path
+
+import anyio
+
+from events import StatsUpdated
+from history import encode_lines
+from messages import split_line
+from metrics import write_snapshot
+
+STATS_FORMAT_VERSION = 1
+DEFAULT_EXACT_NICKNAMES = 10000
+DEFAULT_SKETCH_WIDTH = 16384
+DEFAULT_SKETCH_DEPTH = 4
+DEFAULT_TOP_SIZE = 100
+DEFAULT_HISTOGRAM_MINUTES = 24 * 60
+
+
+def get_stats_path(history_file):
+    history_file = Path(history_file)
+    return history_file.with_name(f'{history_file.name}.stats.json')
+
+
+def get_minute(timestamp):
+    return int(timestamp) // 60 * 60
+
+
+class CountMinSketch:
+    def __init__(self, width=DEFAULT_SKETCH_WIDTH, depth=DEFAULT_SKETCH_DEPTH, counters=None):
+        self.width = width
+        self.depth = depth
+        self.counters = array('Q', counters or bytes(8 * width * depth))
+
+    @classmethod
+    def from_dict(cls, sketch):
+        return cls(sketch['width'], sketch['depth'], zlib.decompress(base64.b64decode(sketch['counters'])))
+
+    def to_dict(self):
+        return {
+            'width': self.width,
+            'depth': self.depth,
+            'counters': base64.b64encode(zlib.compress(self.counters.tobytes())).decode(),
+        }
+
+    def get_positions(self, key):
+        digest = blake2b(key, digest_size=4 * self.depth).digest()
+        return [
+            row * self.width + int.from_bytes(digest[4 * row:4 * row + 4], 'little') % self.width
+            for row in range(self.depth)
+        ]
+
+    def add(self, key, count=1):
+        positions = self.get_positions(key)
+        estimate = min(self.counters[position] for position in positions) + count
+        for position in positions:
+            if self.counters[position] < estimate:
+                self.counters[position] = estimate
+        return estimate
+
+    def estimate(self, key):
+        return min(self.counters[position] for position in self.get_positions(key))
+
+
+class ChatStats:
+    def __init__(
+        self,
+        filepath,
+        exact_nicknames=DEFAULT_EXACT_NICKNAMES,
+        top_size=DEFAULT_TOP_SIZE,
+        histogram_minutes=DEFAULT_HISTOGRAM_MINUTES,
+        sketch_width=DEFAULT_SKETCH_WIDTH,
+        sketch_depth=DEFAULT_SKETCH_DEPTH
+    ):
+        self.filepath = Path(filepath)
+        self.exact_nicknames = exact_nicknames
+        self.top_size = top_size
+        self.histogram_minutes = histogram_minutes
+        self.sketch = CountMinSketch(sketch_width, sketch_depth)
+        self.total = 0
+        self.nicknames = {}
+        self.top = {}
+        self.top_threshold = 0
+        self.minutes = {}
+        self.last_minute = 0
+        self.days = {}
+        self.changed = False
+
+    def load(self):
+        if not self.filepath.exists():
+            return self
+        with open(self.filepath, encoding='utf-8') as stats_file:
+            stats = json.load(stats_file)
+        self.sketch = CountMinSketch.from_dict(stats['sketch'])
+        self.total = stats['total']
+        self.nicknames = stats['nicknames']
+        self.top = stats['top']
+        self.top_threshold = min(self.top.values(), default=0)
+        self.minutes = {int(minute): count for minute, count in stats['minutes'].items()}
+        self.last_minute = max(self.minutes, default=0)
+        self.days = stats['days']
+        return self
+
+    def add(self, messages):
+        nicknames = Counter()
+        minutes = Counter()
+        current_minute = get_minute(time.time())
+        for line in encode_lines(messages).splitlines():
+            if not line.strip():
+                continue
+            timestamp, nickname, _ = split_line(line)
+            minutes[current_minute if timestamp is None else get_minute(timestamp)] += 1
+            if nickname:
+                nicknames[nickname] += 1
+        if not minutes:
+            return
+
+        for nickname, count in nicknames.items():
+            self.add_nickname(nickname, count)
+        for minute, count in minutes.items():
+            self.add_to_histogram(minute, count)
+            day = datetime.date.fromtimestamp(minute).isoformat()
+            self.days[day] = self.days.get(day, 0) + count
+        self.total += sum(minutes.values())
+        self.changed = True
+
+    def add_nickname(self, nickname, count):
+        decoded_nickname = nickname.decode('utf-8', errors='replace')
+        if decoded_nickname in self.nicknames or len(self.nicknames) < self.exact_nicknames:
+            self.nicknames[decoded_nickname] = self.nicknames.get(decoded_nickname, 0) + count
+        else:
+            self.update_top(decoded_nickname, self.sketch.add(nickname, count))
+
+    def update_top(self, nickname, estimate):
+        top = self.top
+        if nickname in top or len(top) < self.top_size:
+            top[nickname] = estimate
+            return
+        if estimate <= self.top_threshold:
+            return
+        weakest = min(top, key=top.get)
+        if estimate > top[weakest]:
+            del top[weakest]
+            top[nickname] = estimate
+        self.top_threshold = min(top.values())
+
+    def add_to_histogram(self, minute, count):
+        cutoff = self.last_minute - self.histogram_minutes * 60
+        if minute <= cutoff:
+            return
+        self.minutes[minute] = self.minutes.get(minute, 0) + count
+        if minute > self.last_minute:
+            self.last_minute = minute
+            cutoff = minute - self.histogram_minutes * 60
+            while self.minutes and next(iter(self.minutes)) <= cutoff:
+                del self.minutes[next(iter(self.minutes))]
+
+    def count(self, nickname):
+        if nickname in self.nicknames:
+            return self.nicknames[nickname]
+        if nickname in self.top:
+            return self.top[nickname]
+        return self.sketch.estimate(nickname.encode())
+
+    def get_top(self, limit=10):
+        return heapq.nlargest(limit, [*self.nicknames.items(), *self.top.items()], key=lambda item: item[1])
+
+    def get_histogram(self, minutes_count=60, until=None):
+        last_minute = get_minute(until or time.time())
+        return [
+            (minute, self.minutes.get(minute, 0))
+            for minute in range(last_minute - (minutes_count - 1) * 60, last_minute + 1, 60)
+        ]
+
+    def get_rate(self, minutes_count=5):
+        previous_minute = get_minute(time.time()) - 60
+        histogram = self.get_histogram(minutes_count, previous_minute)
+        return sum(count for _, count in histogram) / minutes_count
+
+    def take_snapshot(self):
+        self.changed = False
+        return {
+            'version': STATS_FORMAT_VERSION,
+            'saved_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'total': self.total,
+            'sketch': self.sketch.to_dict(),
+            'nicknames': dict(self.nicknames),
+            'top': dict(self.top),
+            'minutes': {str(minute): count for minute, count in self.minutes.items()},
+            'days': dict(self.days),
+        }
+
+
+async def save_stats(chat_stats):
+    if not chat_stats.changed:
+        return
+    snapshot = chat_stats.take_snapshot()
+    with anyio.CancelScope(shield=True):
+        await anyio.to_thread.run_sync(write_snapshot, chat_stats.filepath, snapshot)
+
+
+async def dump_stats(chat_stats, interval):
+    while True:
+        await anyio.sleep(interval)
+        await save_stats(chat_stats)
+
+
+async def report_stats(chat_stats, status_updates_queue, interval=5, top_count=3):
+    while True:
+        status_updates_queue.put_nowait(
+            StatsUpdated(chat_stats.total, chat_stats.get_rate(), chat_stats.get_top(top_count))
+        )
+        await anyio.sleep(interval)
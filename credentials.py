@@ -0,0 +1,52 @@
+import datetime
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger('credentials')
+
+DEFAULT_CREDENTIALS_FILE = 'credentials.json'
+
+
+class CredentialsStore:
+    def __init__(self, filepath=DEFAULT_CREDENTIALS_FILE):
+        self.filepath = Path(filepath)
+        self.hosts = {}
+        self.changed = False
+
+    def load(self):
+        if self.filepath.exists():
+            with open(self.filepath, encoding='utf-8') as credentials_file:
+                self.hosts = json.load(credentials_file)['hosts']
+        return self
+
+    def save(self):
+        if not self.changed:
+            return
+        temporary_path = self.filepath.with_name(f'{self.filepath.name}.tmp')
+        with open(temporary_path, 'w', encoding='utf-8') as credentials_file:
+            json.dump({'hosts': self.hosts}, credentials_file, ensure_ascii=False, indent=2)
+        os.replace(temporary_path, self.filepath)
+        self.changed = False
+
+    def find_token(self, host, nickname):
+        account = self.hosts.get(host, {}).get(nickname)
+        return account['account_hash'] if account else None
+
+    def remember(self, host, credentials):
+        accounts = self.hosts.setdefault(host, {})
+        account = accounts.get(credentials['nickname'])
+        if account and account['account_hash'] == credentials['account_hash']:
+            return False
+        accounts[credentials['nickname']] = {
+            'account_hash': credentials['account_hash'],
+            'validated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        self.changed = True
+        return True
+
+    def forget(self, host, nickname):
+        if self.hosts.get(host, {}).pop(nickname, None):
+            logger.info(f'Forgot rejected token of {nickname} on {host}')
+            self.changed = True
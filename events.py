@@ -0,0 +1,36 @@
+from enum import Enum
+
+
+class ReadConnectionStateChanged(Enum):
+    INITIATED = 'устанавливаем соединение'
+    ESTABLISHED = 'соединение установлено'
+    CLOSED = 'соединение закрыто'
+
+    def __str__(self):
+        return str(self.value)
+
+
+class SendingConnectionStateChanged(Enum):
+    INITIATED = 'устанавливаем соединение'
+    ESTABLISHED = 'соединение установлено'
+    CLOSED = 'соединение закрыто'
+
+    def __str__(self):
+        return str(self.value)
+
+
+class NicknameReceived:
+    def __init__(self, nickname):
+        self.nickname = nickname
+
+
+class OlderMessagesLoaded:
+    def __init__(self, messages):
+        self.messages = messages
+
+
+class StatsUpdated:
+    def __init__(self, total, rate, top):
+        self.total = total
+        self.rate = rate
+        self.top = top
@@ -0,0 +1,32 @@
+import argparse
+import time
+from pathlib import Path
+
+from environs import Env
+
+from history import HistorySegments
+from history_columns import export_columns
+
+
+def main():
+    env = Env()
+    env.read_env()
+
+    parser = argparse.ArgumentParser(description='Export chat history to memory-mappable columns')
+    parser.add_argument('--historyfile', '-f', help='File for history')
+    parser.add_argument('--output', '-o', help='Directory for columns, <historyfile>.columns by default')
+    parser.add_argument('--source', '-s', help='Source name stored with every message, history file name by default')
+    args = parser.parse_args()
+
+    history_file = Path(args.historyfile or env('HISTORY_FILE', default='minechat.history'))
+    output = args.output or history_file.with_name(f'{history_file.name}.columns')
+    source = args.source or history_file.name
+
+    started_at = time.perf_counter()
+    rows = export_columns(HistorySegments(history_file).iterate_raw_lines(), output, source)
+    elapsed = time.perf_counter() - started_at
+    print(f'Выгружено строк: {rows} в {output} за {elapsed:.1f} с ({rows / max(elapsed, 1e-9):.0f} строк/с)')
+
+
+if __name__ == '__main__':
+    main()
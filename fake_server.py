@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from contextlib import suppress
+
+import anyio
+
+logger = logging.getLogger('fake_server')
+
+GREETING = 'Hello %username%! Enter your personal hash or leave it empty to create new account.'
+NICKNAME_QUERY = 'Enter preferred nickname below:'
+WELCOME = 'Welcome to chat! Post your message below. End it with an empty line.'
+MESSAGE_SENT = 'Message send. Write more, end message with an empty line.'
+
+
+class FakeChatServer:
+    def __init__(self, host='127.0.0.1', reading_port=0, writing_port=0, backlog_size=0):
+        self.host = host
+        self.reading_port = reading_port
+        self.writing_port = writing_port
+        self.accounts = {}
+        self.readers = set()
+        self.connections = set()
+        self.servers = []
+        self.received_count = 0
+        self.backlog = deque(maxlen=backlog_size)
+
+    async def start(self):
+        reading_server = await asyncio.start_server(self.handle_reader, self.host, self.reading_port)
+        writing_server = await asyncio.start_server(self.handle_writer, self.host, self.writing_port)
+        self.servers = [reading_server, writing_server]
+        self.reading_port = reading_server.sockets[0].getsockname()[1]
+        self.writing_port = writing_server.sockets[0].getsockname()[1]
+        logger.info(f'Listening on {self.host}, reading port {self.reading_port}, writing port {self.writing_port}')
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.drop_connections()
+
+    def drop_connections(self):
+        for writer in list(self.connections):
+            writer.transport.abort()
+        self.connections.clear()
+        self.readers.clear()
+
+    def register(self, nickname):
+        account_hash = f'{len(self.accounts):08x}-{nickname}'
+        self.accounts[account_hash] = nickname
+        return {'nickname': nickname, 'account_hash': account_hash}
+
+    def broadcast(self, message):
+        line = f'{message}\n'.encode()
+        self.backlog.append(line)
+        for writer in list(self.readers):
+            if writer.transport.is_closing():
+                self.readers.discard(writer)
+                continue
+            writer.write(line)
+
+    async def handle_reader(self, reader, writer):
+        self.connections.add(writer)
+        writer.write(b''.join(self.backlog))
+        self.readers.add(writer)
+        with suppress(ConnectionError):
+            await reader.read()
+        self.readers.discard(writer)
+        self.connections.discard(writer)
+
+    async def handle_writer(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            credentials = await self.authorize(reader, writer)
+            writer.write(f'{WELCOME}\n'.encode())
+            await self.receive_messages(reader, writer, credentials['nickname'])
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def authorize(self, reader, writer):
+        writer.write(f'{GREETING}\n'.encode())
+        token = (await reader.readline()).decode().strip()
+        if token in self.accounts:
+            credentials = {'nickname': self.accounts[token], 'account_hash': token}
+            writer.write(f'{json.dumps(credentials)}\n'.encode())
+            return credentials
+        if token:
+            writer.write(b'null\n')
+        writer.write(f'{NICKNAME_QUERY}\n'.encode())
+        nickname = (await reader.readline()).decode().strip()
+        credentials = self.register(nickname)
+        writer.write(f'{json.dumps(credentials)}\n'.encode())
+        return credentials
+
+    async def receive_messages(self, reader, writer, nickname):
+        lines = []
+        previous_line_blank = False
+        while line := await reader.readline():
+            line = line.decode().rstrip('\n')
+            if line:
+                lines.append(line)
+                previous_line_blank = False
+                continue
+            if lines:
+                self.received_count += 1
+                self.broadcast(f'{nickname}: {" ".join(lines)}')
+                lines = []
+            elif previous_line_blank:
+                continue
+            previous_line_blank = True
+            writer.write(f'{MESSAGE_SENT}\n'.encode())
+            await writer.drain()
+
+
+async def generate_messages(server, rate, nickname='Bot', make_text=None, tick=0.01):
+    started_at = time.monotonic()
+    number = 0
+    while True:
+        due = (time.monotonic() - started_at) * rate
+        while number <= due:
+            text = make_text() if make_text else f'сообщение номер {number}'
+            server.broadcast(f'{nickname}: {text}')
+            number += 1
+        await anyio.sleep(tick)
+
+
+async def drop_connections_periodically(server, interval):
+    while True:
+        await anyio.sleep(interval)
+        logger.info(f'Dropping {len(server.connections)} connections')
+        server.drop_connections()
+
+
+async def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the minechat server')
+    parser.add_argument('--host', '-s', default='127.0.0.1', help='Host')
+    parser.add_argument('--readingport', '-rp', type=int, default=5000, help='Reading port')
+    parser.add_argument('--writingport', '-wp', type=int, default=5050, help='Writing port')
+    parser.add_argument('--rate', '-r', type=float, default=1, help='Bot messages per second, 0 to disable')
+    parser.add_argument('--dropinterval', '-d', type=float, default=0, help='Seconds between dropping connections')
+    parser.add_argument('--backlog', '-b', type=int, default=0, help='Last messages replayed to every new reader')
+    args = parser.parse_args()
+
+    server = FakeChatServer(args.host, args.readingport, args.writingport, args.backlog)
+    await server.start()
+    async with anyio.create_task_group() as tg:
+        if args.rate:
+            tg.start_soon(generate_messages, server, args.rate)
+        if args.dropinterval:
+            tg.start_soon(drop_connections_periodically, server, args.dropinterval)
+        await anyio.sleep_forever()
+
+
+if __name__ == '__main__':
+    with suppress(KeyboardInterrupt):
+        anyio.run(main)
@@ -1,40 +1,44 @@
+import asyncio
+import time
 import tkinter as tk
+from _tkinter import DONT_WAIT
+from collections import deque
+
 import anyio
 from tkinter import messagebox
 from tkinter.scrolledtext import ScrolledText
 from enum import Enum
 
+from events import (  # noqa: F401
+    NicknameReceived,
+    OlderMessagesLoaded,
+    ReadConnectionStateChanged,
+    SendingConnectionStateChanged,
+    StatsUpdated,
+)
+from history_index import make_query, search_history
+from send_scheduler import BulkMessage
+
 
 class TkAppClosed(Exception):
     pass
 
 
-class ReadConnectionStateChanged(Enum):
-    INITIATED = 'устанавливаем соединение'
-    ESTABLISHED = 'соединение установлено'
-    CLOSED = 'соединение закрыто'
-
-    def __str__(self):
-        return str(self.value)
-
-
-class SendingConnectionStateChanged(Enum):
-    INITIATED = 'устанавливаем соединение'
-    ESTABLISHED = 'соединение установлено'
-    CLOSED = 'соединение закрыто'
-
-    def __str__(self):
-        return str(self.value)
-
-
-class NicknameReceived:
-    def __init__(self, nickname):
-        self.nickname = nickname
+class TkUpdateMode(Enum):
+    POLLING = 'polling'
+    ADAPTIVE = 'adaptive'
 
 
 def process_new_message(input_field, sending_queue):
     text = input_field.get()
-    sending_queue.put_nowait(text)
+    lines = text.splitlines()
+    if sending_queue.maxsize and sending_queue.qsize() + len(lines) > sending_queue.maxsize:
+        return
+    if len(lines) > 1:
+        for line in lines:
+            sending_queue.put_nowait(BulkMessage(line))
+    else:
+        sending_queue.put_nowait(text)
     input_field.delete(0, tk.END)
 
 
@@ -42,29 +46,158 @@ async def show_token_error():
     messagebox.showerror('Неверный токен', 'Проверьте токен, сервер его не узнал')
 
 
-async def update_tk(root_frame, interval=1 / 120):
+def process_tk_events(root_frame):
+    root_frame.master.state()  # For raising TclError after closing window
+    processed = False
+    while root_frame.tk.dooneevent(DONT_WAIT):
+        processed = True
+    return processed
+
+
+async def update_tk(
+    root_frame,
+    mode=TkUpdateMode.ADAPTIVE,
+    min_interval=1 / 120,
+    max_interval=1 / 20,
+    metrics=None
+):
+    if mode == TkUpdateMode.POLLING:
+        while True:
+            frame_started_at = time.perf_counter()
+            root_frame.update()
+            if metrics:
+                metrics.observe('minechat_tk_frame_seconds', time.perf_counter() - frame_started_at)
+            await anyio.sleep(min_interval)
+
+    interval = min_interval
     while True:
-        root_frame.update()
+        frame_started_at = time.perf_counter()
+        if process_tk_events(root_frame):
+            interval = min_interval
+            if metrics:
+                metrics.observe('minechat_tk_frame_seconds', time.perf_counter() - frame_started_at)
+        else:
+            interval = min(interval * 2, max_interval)
         await anyio.sleep(interval)
 
 
-async def update_conversation_history(panel, messages_queue):
+def create_history_paging(scrollback_lines, scrollback_buffer_lines, page_size):
+    return {
+        'pending': False,
+        'exhausted': False,
+        'scrollback_lines': scrollback_lines,
+        'page_size': page_size,
+        'trimmed_lines': deque(maxlen=scrollback_buffer_lines),
+        'evicted_lines': 0,
+    }
+
+
+def watch_scroll_position(panel, messages_queue, history_requests_queue, history_paging):
+    def on_scroll(first, last):
+        panel.vbar.set(first, last)
+        if float(first) > 0 or history_paging['pending']:
+            return
+
+        trimmed_lines = history_paging['trimmed_lines']
+        if trimmed_lines:
+            history_paging['pending'] = True
+            page_size = min(history_paging['page_size'], len(trimmed_lines))
+            page = [trimmed_lines.pop() for _ in range(page_size)]
+            page.reverse()
+            messages_queue.put_nowait(OlderMessagesLoaded(page))
+        elif not history_paging['exhausted'] or history_paging['evicted_lines']:
+            history_paging['pending'] = True
+            history_requests_queue.put_nowait(history_paging['evicted_lines'])
+            history_paging['evicted_lines'] = 0
+
+    panel['yscrollcommand'] = on_scroll
+
+
+def insert_older_messages(panel, messages, history_paging):
+    history_paging['pending'] = False
+    if not messages:
+        history_paging['exhausted'] = True
+        return
+
+    block = '\n'.join(messages)
+    if panel.index('end-1c') != '1.0':
+        block += '\n'
+    panel.insert('1.0', block)
+    panel.yview(f'{len(messages) + 1}.0')
+
+
+def take_messages_batch(messages_queue, first_message, max_batch_size):
+    batch = [first_message]
+    while len(batch) < max_batch_size and not messages_queue.empty():
+        batch.append(messages_queue.get_nowait())
+    return batch
+
+
+def append_messages(panel, messages):
+    block = '\n'.join(messages)
+    if panel.index('end-1c') != '1.0':
+        block = '\n' + block
+    panel.insert('end', block)
+
+
+def trim_scrollback(panel, history_paging, stick_to_bottom):
+    scrollback_lines = history_paging['scrollback_lines']
+    lines_count = int(panel.index('end-1c').split('.')[0])
+    if lines_count <= scrollback_lines:
+        return
+    if not stick_to_bottom and lines_count <= scrollback_lines * 2:
+        return
+
+    trim_count = min(lines_count - scrollback_lines + history_paging['page_size'], lines_count - 1)
+    trimmed_text = panel.get('1.0', f'{trim_count + 1}.0')
+    trimmed_lines = history_paging['trimmed_lines']
+    new_trimmed_lines = trimmed_text.split('\n')[:-1]
+    history_paging['evicted_lines'] += max(len(trimmed_lines) + len(new_trimmed_lines) - trimmed_lines.maxlen, 0)
+    trimmed_lines.extend(new_trimmed_lines)
+    panel.delete('1.0', f'{trim_count + 1}.0')
+
+
+def render_messages(panel, batch, history_paging):
+    stick_to_bottom = panel.yview()[1] >= 1.0
+    panel['state'] = 'normal'
+
+    new_messages = []
+    for msg in batch:
+        if isinstance(msg, OlderMessagesLoaded):
+            if new_messages:
+                append_messages(panel, new_messages)
+                new_messages = []
+            insert_older_messages(panel, msg.messages, history_paging)
+        else:
+            new_messages.append(msg)
+    if new_messages:
+        append_messages(panel, new_messages)
+        trim_scrollback(panel, history_paging, stick_to_bottom)
+        if stick_to_bottom:
+            panel.yview(tk.END)
+
+    panel['state'] = 'disabled'
+
+
+async def update_conversation_history(
+    panel,
+    messages_queue,
+    history_paging,
+    tk_update_mode=TkUpdateMode.ADAPTIVE,
+    max_batch_size=500,
+    interval=1 / 120
+):
     while True:
         msg = await messages_queue.get()
-
-        panel['state'] = 'normal'
-        if panel.index('end-1c') != '1.0':
-            panel.insert('end', '\n')
-        panel.insert('end', msg)
-        # TODO сделать промотку умной, чтобы не мешала просматривать историю сообщений
-        # ScrolledText.frame
-        # ScrolledText.vbar
-        panel.yview(tk.END)
-        panel['state'] = 'disabled'
+        batch = take_messages_batch(messages_queue, msg, max_batch_size)
+        render_messages(panel, batch, history_paging)
+        if tk_update_mode == TkUpdateMode.ADAPTIVE:
+            panel.update_idletasks()
+        await anyio.sleep(interval)
 
 
 async def update_status_panel(status_labels, status_updates_queue):
-    nickname_label, read_label, write_label = status_labels
+    nickname_label, read_label, write_label, stats_label = status_labels
 
     read_label['text'] = 'Чтение: нет соединения'
     write_label['text'] = 'Отправка: нет соединения'
@@ -81,6 +214,63 @@ async def update_status_panel(status_labels, status_updates_queue):
         if isinstance(msg, NicknameReceived):
             nickname_label['text'] = f'Имя пользователя: {msg.nickname}'
 
+        if isinstance(msg, StatsUpdated):
+            top = ', '.join(f'{nickname} ({count})' for nickname, count in msg.top)
+            stats_label['text'] = f'Сообщений: {msg.total}, в минуту: {msg.rate:.0f}, активнее всех: {top or "—"}'
+
+
+def put_search_query(search_field, search_queue):
+    search_queue.put_nowait(search_field.get().strip())
+
+
+def find_in_panel(panel, text):
+    start = panel.index('found.first') if panel.tag_ranges('found') else 'end'
+    index = panel.search(text, start, stopindex='1.0', backwards=True, nocase=True)
+    if not index:
+        return False
+    panel.tag_remove('found', '1.0', 'end')
+    panel.tag_add('found', index, f'{index}+{len(text)}c')
+    panel.see(index)
+    return True
+
+
+def show_search_results(text, results):
+    if not results:
+        messagebox.showinfo('Поиск по истории', f'Ничего не найдено по запросу «{text}»')
+        return
+
+    results_window = tk.Toplevel()
+    results_window.title(f'Поиск по истории: {text}')
+    results_panel = ScrolledText(results_window, wrap='none')
+    results_panel.pack(fill="both", expand=True)
+    results_panel.insert('end', '\n'.join(message for _, message in reversed(results)))
+    results_panel['state'] = 'disabled'
+
+
+async def search_messages(panel, search_queue, history_index):
+    panel.tag_configure('found', background='yellow')
+    while True:
+        text = await search_queue.get()
+        if not text or find_in_panel(panel, text):
+            continue
+        if history_index:
+            results = await search_history(history_index, make_query(text))
+            show_search_results(text, results)
+
+
+def create_search_panel(root_frame, search_queue):
+    search_frame = tk.Frame(root_frame)
+    search_frame.pack(side="top", fill=tk.X)
+
+    search_field = tk.Entry(search_frame)
+    search_field.pack(side="left", fill=tk.X, expand=True)
+    search_field.bind("<Return>", lambda event: put_search_query(search_field, search_queue))
+
+    search_button = tk.Button(search_frame)
+    search_button["text"] = "Найти"
+    search_button["command"] = lambda: put_search_query(search_field, search_queue)
+    search_button.pack(side="left")
+
 
 def create_status_panel(root_frame):
     status_frame = tk.Frame(root_frame)
@@ -98,10 +288,24 @@ def create_status_panel(root_frame):
     status_write_label = tk.Label(connections_frame, height=1, fg='grey', font='arial 10', anchor='w')
     status_write_label.pack(side="top", fill=tk.X)
 
-    return (nickname_label, status_read_label, status_write_label)
+    stats_label = tk.Label(connections_frame, height=1, fg='grey', font='arial 10', anchor='w')
+    stats_label.pack(side="top", fill=tk.X)
 
+    return (nickname_label, status_read_label, status_write_label, stats_label)
 
-async def draw(messages_queue, sending_queue, status_updates_queue):
+
+async def draw(
+    messages_queue,
+    sending_queue,
+    status_updates_queue,
+    history_requests_queue,
+    scrollback_lines=5000,
+    scrollback_buffer_lines=20000,
+    page_size=1000,
+    tk_update_mode=TkUpdateMode.ADAPTIVE,
+    history_index=None,
+    metrics=None
+):
     root = tk.Tk()
 
     root.title('Чат Майнкрафтера')
@@ -111,6 +315,9 @@ async def draw(messages_queue, sending_queue, status_updates_queue):
 
     status_labels = create_status_panel(root_frame)
 
+    search_queue = asyncio.Queue()
+    create_search_panel(root_frame, search_queue)
+
     input_frame = tk.Frame(root_frame)
     input_frame.pack(side="bottom", fill=tk.X)
 
@@ -127,10 +334,20 @@ async def draw(messages_queue, sending_queue, status_updates_queue):
     conversation_panel = ScrolledText(root_frame, wrap='none')
     conversation_panel.pack(side="top", fill="both", expand=True)
 
+    history_paging = create_history_paging(scrollback_lines, scrollback_buffer_lines, page_size)
+    watch_scroll_position(conversation_panel, messages_queue, history_requests_queue, history_paging)
+
     try:
         async with anyio.create_task_group() as tg:
-            tg.start_soon(update_tk, root_frame)
-            tg.start_soon(update_conversation_history, conversation_panel, messages_queue)
+            tg.start_soon(update_tk, root_frame, tk_update_mode, 1 / 120, 1 / 20, metrics)
+            tg.start_soon(
+                update_conversation_history,
+                conversation_panel,
+                messages_queue,
+                history_paging,
+                tk_update_mode
+            )
             tg.start_soon(update_status_panel, status_labels, status_updates_queue)
+            tg.start_soon(search_messages, conversation_panel, search_queue, history_index)
     except (anyio.ExceptionGroup, tk.TclError):
         raise TkAppClosed()
@@ -1,4 +1,6 @@
 import tkinter as tk
+from _tkinter import DONT_WAIT
+
 import anyio
 from tkinter import messagebox
 
@@ -19,10 +21,21 @@ async def show_success(nickname):
     raise TkAppClosed
 
 
-async def update_tk(root_frame, interval=1 / 120):
+def process_tk_events(root_frame):
+    root_frame.master.state()  # For raising TclError after closing window
+    processed = False
+    while root_frame.tk.dooneevent(DONT_WAIT):
+        processed = True
+    return processed
+
+
+async def update_tk(root_frame, min_interval=1 / 120, max_interval=1 / 20):
+    interval = min_interval
     while True:
-        root_frame.master.state()  # For raising TclError after closing window
-        root_frame.update()
+        if process_tk_events(root_frame):
+            interval = min_interval
+        else:
+            interval = min(interval * 2, max_interval)
         await anyio.sleep(interval)
 
 
@@ -0,0 +1,487 @@
+import datetime
+import gzip
+import io
+import json
+import logging
+import lzma
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+
+import anyio
+
+from history_time_index import (
+    DEFAULT_TIME_INDEX_INTERVAL,
+    TimeIndex,
+    filter_range,
+    get_time_index_path,
+    iterate_mapped_range,
+)
+from messages import split_timestamp
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('history')
+
+READ_CHUNK_SIZE = 64 * 1024
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+GZIP_LEVEL = 6
+LZMA_PRESET = 2
+
+compression_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-compression')
+
+
+class FsyncPolicy(Enum):
+    NONE = 'none'
+    PERIODIC = 'periodic'
+    BATCH = 'batch'
+
+
+class Compression(Enum):
+    NONE = 'none'
+    GZIP = 'gzip'
+    LZMA = 'lzma'
+
+
+SEGMENT_SUFFIXES = {
+    Compression.NONE: '',
+    Compression.GZIP: '.gz',
+    Compression.LZMA: '.xz',
+}
+
+
+def encode_lines(messages):
+    return b''.join(message if isinstance(message, bytes) else f'{message}\n'.encode() for message in messages)
+
+
+def decode_lines(messages):
+    for message in messages:
+        if isinstance(message, bytes):
+            yield from message.decode('utf-8', errors='replace').rstrip('\n').split('\n')
+        else:
+            yield message
+
+
+class HistorySegments:
+    def __init__(self, filepath):
+        self.filepath = Path(filepath)
+        self.manifest_path = self.filepath.with_name(f'{self.filepath.name}.manifest.json')
+
+    def load_manifest(self):
+        if not self.manifest_path.exists():
+            return []
+        with open(self.manifest_path, encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)['segments']
+
+    def save_manifest(self, segments):
+        temporary_path = self.manifest_path.with_name(f'{self.manifest_path.name}.tmp')
+        with open(temporary_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump({'segments': segments}, manifest_file, ensure_ascii=False, indent=2)
+        os.replace(temporary_path, self.manifest_path)
+
+    def open_segment(self, name):
+        segment_path = self.filepath.with_name(name)
+        if not segment_path.exists():
+            for suffix in (SEGMENT_SUFFIXES[Compression.GZIP], SEGMENT_SUFFIXES[Compression.LZMA]):
+                if self.filepath.with_name(f'{name}{suffix}').exists():
+                    name = f'{name}{suffix}'
+                    segment_path = self.filepath.with_name(name)
+        if name.endswith(SEGMENT_SUFFIXES[Compression.GZIP]):
+            return gzip.open(segment_path, 'rb')
+        if name.endswith(SEGMENT_SUFFIXES[Compression.LZMA]):
+            return lzma.open(segment_path, 'rb')
+        return open(segment_path, 'rb')
+
+    def read_segment(self, name):
+        with self.open_segment(name) as segment_file:
+            return segment_file.read()
+
+    def iterate_raw_lines(self):
+        for segment in self.load_manifest():
+            with self.open_segment(segment['file']) as segment_file:
+                yield from segment_file
+        if not self.filepath.exists():
+            return
+        with open(self.filepath, 'rb') as chatfile:
+            yield from chatfile
+
+    def iterate_lines(self):
+        for line in self.iterate_raw_lines():
+            yield line.rstrip(b'\n').decode('utf-8', errors='replace')
+
+    def iterate_range(self, since=None, until=None):
+        for segment in self.load_manifest():
+            if since is not None and segment.get('last_timestamp', since) < since:
+                continue
+            if until is not None and segment.get('first_timestamp', until - 1) >= until:
+                return
+            segment_path = self.filepath.with_name(segment['file'])
+            if get_time_index_path(segment_path).exists():
+                reached_until = yield from iterate_mapped_range(segment_path, since, until)
+            else:
+                with self.open_segment(segment['file']) as segment_file:
+                    reached_until = yield from filter_range(segment_file, since, until)
+            if reached_until:
+                return
+        if self.filepath.exists():
+            yield from iterate_mapped_range(self.filepath, since, until)
+
+    def close_active(self):
+        closed_at = datetime.datetime.now()
+        name = f'{self.filepath.name}.{closed_at:%Y%m%d-%H%M%S}'
+        counter = 1
+        while any(self.filepath.with_name(f'{name}{suffix}').exists() for suffix in SEGMENT_SUFFIXES.values()):
+            name = f'{self.filepath.name}.{closed_at:%Y%m%d-%H%M%S}-{counter}'
+            counter += 1
+        segment_path = self.filepath.with_name(name)
+
+        size = self.filepath.stat().st_size
+        time_range = read_time_range(self.filepath)
+        time_index_path = get_time_index_path(self.filepath)
+        if time_index_path.exists():
+            os.replace(time_index_path, get_time_index_path(segment_path))
+        os.replace(self.filepath, segment_path)
+
+        segments = self.load_manifest()
+        segments.append({
+            'file': name,
+            'size': size,
+            'stored_size': size,
+            'closed_at': closed_at.isoformat(timespec='seconds'),
+            **time_range,
+        })
+        self.save_manifest(segments)
+        return name
+
+    def compress_segment(self, name, compression):
+        compressed_name = f'{name}{SEGMENT_SUFFIXES[compression]}'
+        compressed_path = self.filepath.with_name(compressed_name)
+        temporary_path = self.filepath.with_name(f'{compressed_name}.tmp')
+        if compression == Compression.GZIP:
+            destination = gzip.open(temporary_path, 'wb', compresslevel=GZIP_LEVEL)
+        else:
+            destination = lzma.open(temporary_path, 'wb', preset=LZMA_PRESET)
+        with open(self.filepath.with_name(name), 'rb') as source, destination:
+            shutil.copyfileobj(source, destination)
+        os.replace(temporary_path, compressed_path)
+        return compressed_name
+
+    def replace_segment(self, name, compressed_name):
+        segments = self.load_manifest()
+        for segment in segments:
+            if segment['file'] == name:
+                segment['file'] = compressed_name
+                segment['stored_size'] = self.filepath.with_name(compressed_name).stat().st_size
+        self.save_manifest(segments)
+        segment_path = self.filepath.with_name(name)
+        get_time_index_path(segment_path).unlink(missing_ok=True)
+        segment_path.unlink()
+
+
+class HistoryWriter:
+    def __init__(
+        self,
+        filepath,
+        fsync_policy=FsyncPolicy.NONE,
+        fsync_interval=1,
+        segment_size=DEFAULT_SEGMENT_SIZE,
+        daily_segments=False,
+        compression=Compression.GZIP,
+        indexed=True,
+        time_index_interval=DEFAULT_TIME_INDEX_INTERVAL
+    ):
+        self.filepath = Path(filepath)
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.daily_segments = daily_segments
+        self.compression = compression
+        self.segments = HistorySegments(filepath)
+        self.history_index = None
+        if indexed:
+            from history_index import HistoryIndex
+
+            self.history_index = HistoryIndex(filepath)
+        self.time_index = TimeIndex(filepath, time_index_interval) if time_index_interval else None
+        self.buffer = []
+        self.chatfile = None
+        self.lock_file = None
+        self.thread_lock = threading.Lock()
+        self.compressions = []
+        self.active_day = None
+        self.last_fsync_at = time.monotonic()
+
+    async def __aenter__(self):
+        self.lock_file = open(self.filepath.with_name(f'{self.filepath.name}.lock'), 'ab')
+        await anyio.to_thread.run_sync(self.open_active)
+        if self.history_index:
+            await anyio.to_thread.run_sync(self.history_index.open)
+        return self
+
+    def open_active(self):
+        self.chatfile = open(self.filepath, 'ab')
+        if self.chatfile.tell():
+            self.active_day = datetime.date.fromtimestamp(self.filepath.stat().st_mtime)
+        else:
+            self.active_day = datetime.date.today()
+        if self.time_index:
+            self.time_index.open()
+
+    def rotate(self):
+        if self.fsync_policy != FsyncPolicy.NONE:
+            os.fsync(self.chatfile.fileno())
+        self.chatfile.close()
+        if self.time_index:
+            self.time_index.close()
+        segment_name = self.segments.close_active()
+        self.open_active()
+        if self.compression != Compression.NONE:
+            self.compressions = [compression for compression in self.compressions if not compression.done()]
+            self.compressions.append(compression_executor.submit(self.compress_segment, segment_name))
+
+    def compress_segment(self, name):
+        try:
+            compressed_name = self.segments.compress_segment(name, self.compression)
+        except OSError as error:
+            logger.warning(f'Segment {name} left uncompressed: {error!r}')
+            return
+        with self.locked():
+            self.segments.replace_segment(name, compressed_name)
+
+    @contextmanager
+    def locked(self):
+        with self.thread_lock:
+            if not fcntl:
+                yield
+                return
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def active_replaced(self):
+        try:
+            path_stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return True
+        file_stat = os.fstat(self.chatfile.fileno())
+        return (path_stat.st_dev, path_stat.st_ino) != (file_stat.st_dev, file_stat.st_ino)
+
+    def reopen_active(self):
+        self.chatfile.close()
+        if self.time_index:
+            self.time_index.close()
+        self.open_active()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        with anyio.CancelScope(shield=True):
+            await self.flush(force_fsync=self.fsync_policy != FsyncPolicy.NONE)
+            await anyio.to_thread.run_sync(self.chatfile.close)
+            await anyio.to_thread.run_sync(wait, self.compressions)
+            self.lock_file.close()
+            if self.time_index:
+                await anyio.to_thread.run_sync(self.time_index.close)
+            if self.history_index:
+                await anyio.to_thread.run_sync(self.history_index.close)
+
+    def write(self, message):
+        self.buffer.append(message)
+
+    def take_batch(self, force_fsync=False):
+        messages, self.buffer = self.buffer, []
+        fsync = force_fsync or self.fsync_policy == FsyncPolicy.BATCH
+        if self.fsync_policy == FsyncPolicy.PERIODIC and time.monotonic() - self.last_fsync_at >= self.fsync_interval:
+            fsync = True
+        return messages, fsync
+
+    async def flush(self, force_fsync=False):
+        if not self.buffer and not force_fsync:
+            return
+        messages, fsync = self.take_batch(force_fsync)
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(self.write_to_file, messages, fsync)
+
+    def write_to_file(self, messages, fsync):
+        with self.locked():
+            self.write_locked(messages, fsync)
+
+    def write_locked(self, messages, fsync):
+        if self.active_replaced():
+            self.reopen_active()
+        offset = self.chatfile.seek(0, 2)
+        if self.daily_segments and offset and self.active_day != datetime.date.today():
+            self.rotate()
+            offset = 0
+        data = encode_lines(messages)
+        self.chatfile.write(data)
+        self.chatfile.flush()
+        if self.time_index:
+            self.time_index.add(data, offset)
+        if self.history_index:
+            self.history_index.add(decode_lines(messages))
+        if fsync:
+            os.fsync(self.chatfile.fileno())
+            self.last_fsync_at = time.monotonic()
+        if self.segment_size and self.chatfile.tell() >= self.segment_size:
+            self.rotate()
+
+
+def history_writer_options(env):
+    return {
+        'fsync_policy': FsyncPolicy(env('HISTORY_FSYNC', default='none')),
+        'fsync_interval': env.float('HISTORY_FSYNC_INTERVAL', default=1),
+        'segment_size': env.int('HISTORY_SEGMENT_SIZE', default=DEFAULT_SEGMENT_SIZE),
+        'daily_segments': env.bool('HISTORY_DAILY_SEGMENTS', default=False),
+        'compression': Compression(env('HISTORY_COMPRESSION', default='gzip')),
+        'indexed': env.bool('HISTORY_INDEX', default=True),
+        'time_index_interval': env.int('HISTORY_TIME_INDEX_INTERVAL', default=DEFAULT_TIME_INDEX_INTERVAL),
+    }
+
+
+async def flush_writers(history_writers):
+    batches = [
+        (history_writer, *history_writer.take_batch())
+        for history_writer in history_writers
+        if history_writer.buffer
+    ]
+
+    def write_batches():
+        for history_writer, messages, fsync in batches:
+            history_writer.write_to_file(messages, fsync)
+
+    with anyio.CancelScope(shield=True):
+        await anyio.to_thread.run_sync(write_batches)
+
+
+def read_history_range(filepath, since=None, until=None):
+    return [
+        line.rstrip(b'\n').decode('utf-8', errors='replace')
+        for line in HistorySegments(filepath).iterate_range(since, until)
+    ]
+
+
+class HistoryReader:
+    def __init__(self, filepath):
+        self.segments = HistorySegments(filepath)
+        self.chatfile = None
+        self.offset = 0
+        self.pending_segments = None
+
+    def open_active(self):
+        self.pending_segments = [segment['file'] for segment in self.segments.load_manifest()]
+        if self.segments.filepath.exists():
+            self.chatfile = open(self.segments.filepath, 'rb')
+            self.offset = self.chatfile.seek(0, 2)
+
+    def open_next_segment(self):
+        if self.chatfile:
+            self.chatfile.close()
+            self.chatfile = None
+        if not self.pending_segments:
+            return False
+        self.chatfile = io.BytesIO(self.segments.read_segment(self.pending_segments.pop()))
+        self.offset = len(self.chatfile.getbuffer())
+        return True
+
+    def open_newer_file(self):
+        segment_names = [segment['file'] for segment in self.segments.load_manifest()]
+        file_index = len(self.pending_segments) + 1 if self.chatfile else 0
+        if file_index > len(segment_names):
+            return False
+        if self.chatfile:
+            self.chatfile.close()
+            self.chatfile = None
+        self.pending_segments = segment_names[:file_index]
+        self.offset = 0
+        if file_index < len(segment_names):
+            self.chatfile = io.BytesIO(self.segments.read_segment(segment_names[file_index]))
+        elif self.segments.filepath.exists():
+            self.chatfile = open(self.segments.filepath, 'rb')
+        return bool(self.chatfile)
+
+    def unread(self, lines_count):
+        if self.pending_segments is None:
+            return
+        while lines_count:
+            if self.chatfile:
+                self.offset, lines_count = skip_lines_after(self.chatfile, self.offset, lines_count)
+            if lines_count and not self.open_newer_file():
+                break
+
+    def read_older(self, lines_count):
+        if self.pending_segments is None:
+            self.open_active()
+
+        lines = []
+        while len(lines) < lines_count:
+            if not self.offset:
+                if not self.open_next_segment():
+                    break
+                continue
+            page, self.offset = read_lines_before(self.chatfile, self.offset, lines_count - len(lines))
+            lines = page + lines
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+
+def read_time_range(filepath):
+    with open(filepath, 'rb') as chatfile:
+        first_timestamp, _ = split_timestamp(chatfile.readline())
+        last_lines, _ = read_lines_before(chatfile, chatfile.seek(0, 2), 1)
+    last_timestamp, _ = split_timestamp(last_lines[0]) if last_lines else (None, b'')
+    time_range = {}
+    if first_timestamp is not None:
+        time_range['first_timestamp'] = first_timestamp
+    if last_timestamp is not None:
+        time_range['last_timestamp'] = last_timestamp
+    return time_range
+
+
+def read_lines_before(chatfile, end, lines_count):
+    position = end
+    chunks = []
+    newlines_count = 0
+    while position > 0 and newlines_count <= lines_count:
+        chunk_size = min(READ_CHUNK_SIZE, position)
+        position -= chunk_size
+        chatfile.seek(position)
+        chunk = chatfile.read(chunk_size)
+        chunks.append(chunk)
+        newlines_count += chunk.count(b'\n')
+
+    data = b''.join(reversed(chunks))
+    ends_with_newline = data.endswith(b'\n')
+    lines = (data[:-1] if ends_with_newline else data).split(b'\n')
+    if position > 0:
+        lines = lines[1:]
+    lines = lines[-lines_count:]
+    taken_size = len(b'\n'.join(lines)) + ends_with_newline if lines else 0
+    return lines, end - taken_size
+
+
+def skip_lines_after(chatfile, start, lines_count):
+    position = start
+    chatfile.seek(start)
+    while lines_count:
+        chunk = chatfile.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        newlines_count = chunk.count(b'\n')
+        if newlines_count < lines_count:
+            lines_count -= newlines_count
+            position += len(chunk)
+            continue
+        newline_index = -1
+        for _ in range(lines_count):
+            newline_index = chunk.index(b'\n', newline_index + 1)
+        position += newline_index + 1
+        lines_count = 0
+    return position, lines_count
@@ -0,0 +1,157 @@
+import json
+import mmap
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+
+from messages import Message, split_line
+
+FORMAT_VERSION = 2
+EXPORT_BATCH_SIZE = 100000
+NO_TIMESTAMP = -1
+
+COLUMNS = {
+    'timestamps': 'q',
+    'range_timestamps': 'q',
+    'nicknames': 'I',
+    'sources': 'H',
+    'text_offsets': 'Q',
+}
+
+
+class ColumnsWriter:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.column_files = {}
+        self.text_file = None
+        self.nickname_ids = {}
+        self.source_ids = {}
+        self.rows = 0
+        self.text_size = 0
+        self.last_timestamp = NO_TIMESTAMP
+        self.batch = {name: array(typecode) for name, typecode in COLUMNS.items()}
+        self.text_batch = []
+
+    def __enter__(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.column_files = {name: open(self.directory / f'{name}.bin', 'wb') for name in COLUMNS}
+        self.text_file = open(self.directory / 'text.bin', 'wb')
+        self.batch['text_offsets'].append(0)
+        return self
+
+    def add_lines(self, lines, source=''):
+        source_id = self.source_ids.setdefault(source, len(self.source_ids))
+        timestamps = self.batch['timestamps']
+        range_timestamps = self.batch['range_timestamps']
+        nicknames = self.batch['nicknames']
+        sources = self.batch['sources']
+        text_offsets = self.batch['text_offsets']
+        nickname_ids = self.nickname_ids
+        last_timestamp = self.last_timestamp
+        for line in lines:
+            timestamp, nickname, text = split_line(line.rstrip(b'\n'))
+            if timestamp is None:
+                timestamps.append(NO_TIMESTAMP)
+            else:
+                timestamps.append(timestamp)
+                last_timestamp = max(last_timestamp, timestamp)
+            range_timestamps.append(last_timestamp)
+            nickname_id = nickname_ids.get(nickname)
+            if nickname_id is None:
+                nickname_id = nickname_ids[nickname] = len(nickname_ids)
+            nicknames.append(nickname_id)
+            sources.append(source_id)
+            self.text_size += len(text)
+            text_offsets.append(self.text_size)
+            self.text_batch.append(text)
+            if len(self.text_batch) >= EXPORT_BATCH_SIZE:
+                self.write_batch()
+        self.last_timestamp = last_timestamp
+
+    def write_batch(self):
+        for name, column in self.batch.items():
+            column.tofile(self.column_files[name])
+            del column[:]
+        self.text_file.write(b''.join(self.text_batch))
+        self.rows += len(self.text_batch)
+        self.text_batch = []
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.write_batch()
+        for column_file in self.column_files.values():
+            column_file.close()
+        self.text_file.close()
+        if exc_type:
+            return
+        meta = {
+            'version': FORMAT_VERSION,
+            'rows': self.rows,
+            'columns': COLUMNS,
+            'nicknames': [nickname.decode('utf-8', errors='replace') for nickname in self.nickname_ids],
+            'sources': list(self.source_ids),
+        }
+        with open(self.directory / 'meta.json', 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file, ensure_ascii=False)
+
+
+def export_columns(lines, directory, source=''):
+    with ColumnsWriter(directory) as columns_writer:
+        columns_writer.add_lines(lines, source)
+    return columns_writer.rows
+
+
+class HistoryColumns:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.files = []
+        self.maps = []
+
+    def open_column(self, filename, typecode=None):
+        column_file = open(self.directory / filename, 'rb')
+        self.files.append(column_file)
+        if not column_file.seek(0, 2):
+            return memoryview(b'').cast(typecode) if typecode else b''
+        column_map = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(column_map)
+        return memoryview(column_map).cast(typecode) if typecode else column_map
+
+    def __enter__(self):
+        with open(self.directory / 'meta.json', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        self.rows = meta['rows']
+        self.nicknames = meta['nicknames']
+        self.sources = meta['sources']
+        self.timestamps = self.open_column('timestamps.bin', COLUMNS['timestamps'])
+        self.range_timestamps = self.open_column('range_timestamps.bin', COLUMNS['range_timestamps'])
+        self.nickname_ids = self.open_column('nicknames.bin', COLUMNS['nicknames'])
+        self.source_ids = self.open_column('sources.bin', COLUMNS['sources'])
+        self.text_offsets = self.open_column('text_offsets.bin', COLUMNS['text_offsets'])
+        self.text = self.open_column('text.bin')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for column in (self.timestamps, self.range_timestamps, self.nickname_ids, self.source_ids, self.text_offsets):
+            column.release()
+        for column_map in self.maps:
+            column_map.close()
+        for column_file in self.files:
+            column_file.close()
+
+    def get_message(self, row):
+        timestamp = self.timestamps[row]
+        return Message(
+            None if timestamp == NO_TIMESTAMP else timestamp,
+            self.nicknames[self.nickname_ids[row]],
+            self.text[self.text_offsets[row]:self.text_offsets[row + 1]].decode('utf-8', errors='replace'),
+            self.sources[self.source_ids[row]]
+        )
+
+    def count_by_nickname(self):
+        counts = Counter(self.nickname_ids)
+        return {self.nicknames[nickname_id]: count for nickname_id, count in counts.items()}
+
+    def find_rows(self, since=None, until=None):
+        start = 0 if since is None else bisect_left(self.range_timestamps, since)
+        end = self.rows if until is None else bisect_left(self.range_timestamps, until)
+        return range(start, max(start, end))
@@ -0,0 +1,65 @@
+import sqlite3
+from pathlib import Path
+
+import anyio
+
+from messages import parse_line
+
+SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(nickname, message, tokenize = 'unicode61')
+'''
+
+
+def get_index_path(history_file):
+    history_file = Path(history_file)
+    return history_file.with_name(f'{history_file.name}.index.sqlite')
+
+
+def quote_term(term):
+    quote = '"'
+    return f'"{term.replace(quote, quote * 2)}"'
+
+
+def make_query(text, nickname=None):
+    terms = [quote_term(word) for word in text.split()]
+    if nickname:
+        terms.append(f'nickname : {quote_term(nickname)}')
+    return ' '.join(terms)
+
+
+class HistoryIndex:
+    def __init__(self, history_file):
+        self.index_path = get_index_path(history_file)
+        self.connection = None
+
+    def open(self):
+        self.connection = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute(SCHEMA)
+        return self
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, messages):
+        self.connection.executemany(
+            'INSERT INTO messages (nickname, message) VALUES (?, ?)',
+            ((parse_line(message).nickname, message) for message in messages)
+        )
+        self.connection.commit()
+
+    def clear(self):
+        self.connection.execute('DELETE FROM messages')
+        self.connection.commit()
+
+    def search(self, query, limit=100):
+        cursor = self.connection.execute(
+            'SELECT rowid, message FROM messages WHERE messages MATCH ? ORDER BY rowid DESC LIMIT ?',
+            (query, limit)
+        )
+        return cursor.fetchall()
+
+
+async def search_history(history_index, query, limit=100):
+    return await anyio.to_thread.run_sync(history_index.search, query, limit)
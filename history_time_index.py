@@ -0,0 +1,125 @@
+import datetime
+import mmap
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from messages import split_timestamp
+
+DEFAULT_TIME_INDEX_INTERVAL = 1000
+ENTRY_TYPECODE = 'q'
+ENTRY_SIZE = 2 * array(ENTRY_TYPECODE).itemsize
+
+
+def get_time_index_path(history_file):
+    history_file = Path(history_file)
+    return history_file.with_name(f'{history_file.name}.timeindex')
+
+
+def parse_datetime(text):
+    return int(datetime.datetime.fromisoformat(text).timestamp())
+
+
+class TimeIndex:
+    def __init__(self, history_file, interval=DEFAULT_TIME_INDEX_INTERVAL):
+        self.history_file = Path(history_file)
+        self.index_path = get_time_index_path(history_file)
+        self.interval = interval
+        self.index_file = None
+        self.lines_since_entry = interval
+        self.last_timestamp = None
+
+    def open(self):
+        history_size = self.history_file.stat().st_size if self.history_file.exists() else 0
+        entries = read_entries(self.index_path)
+        if history_size and (not self.index_path.exists() or entries and entries[-1] >= history_size):
+            self.rebuild()
+            return self
+        self.index_file = open(self.index_path, 'ab' if history_size else 'wb')
+        self.lines_since_entry = self.interval
+        self.last_timestamp = entries[-2] if entries and history_size else None
+        return self
+
+    def close(self):
+        self.index_file.close()
+        self.index_file = None
+
+    def rebuild(self):
+        self.index_file = open(self.index_path, 'wb')
+        self.lines_since_entry = self.interval
+        self.last_timestamp = None
+        offset = 0
+        with open(self.history_file, 'rb') as chatfile:
+            while block := chatfile.read(1024 * 1024):
+                block += chatfile.readline()
+                self.add(block, offset)
+                offset += len(block)
+
+    def add(self, block, offset):
+        lines_count = block.count(b'\n')
+        if self.lines_since_entry + lines_count < self.interval:
+            self.lines_since_entry += lines_count
+            return
+
+        entries = array(ENTRY_TYPECODE)
+        position = offset
+        for line in block.splitlines(keepends=True):
+            self.lines_since_entry += 1
+            if self.lines_since_entry >= self.interval:
+                timestamp, _ = split_timestamp(line)
+                if timestamp is not None and (self.last_timestamp is None or timestamp >= self.last_timestamp):
+                    entries.extend((timestamp, position))
+                    self.last_timestamp = timestamp
+                    self.lines_since_entry = 0
+            position += len(line)
+        if entries:
+            entries.tofile(self.index_file)
+            self.index_file.flush()
+
+
+def read_entries(index_path):
+    entries = array(ENTRY_TYPECODE)
+    if not index_path.exists():
+        return entries
+    with open(index_path, 'rb') as index_file:
+        data = index_file.read()
+    entries.frombytes(data[:len(data) - len(data) % ENTRY_SIZE])
+    return entries
+
+
+def find_offset(index_path, since):
+    if since is None or not index_path.exists():
+        return 0
+    with open(index_path, 'rb') as index_file:
+        size = index_file.seek(0, 2)
+        size -= size % ENTRY_SIZE
+        if not size:
+            return 0
+        with mmap.mmap(index_file.fileno(), size, access=mmap.ACCESS_READ) as index_map:
+            with memoryview(index_map) as data, data.cast(ENTRY_TYPECODE) as entries:
+                with entries[0::2] as timestamps:
+                    position = bisect_left(timestamps, since)
+                return entries[2 * position - 1] if position else 0
+
+
+def filter_range(lines, since=None, until=None):
+    in_range = since is None
+    for line in lines:
+        timestamp, _ = split_timestamp(line)
+        if timestamp is not None:
+            if until is not None and timestamp >= until:
+                return True
+            in_range = since is None or timestamp >= since
+        if in_range:
+            yield line
+    return False
+
+
+def iterate_mapped_range(history_file, since=None, until=None):
+    history_file = Path(history_file)
+    with open(history_file, 'rb') as chatfile:
+        if not chatfile.seek(0, 2):
+            return False
+        with mmap.mmap(chatfile.fileno(), 0, access=mmap.ACCESS_READ) as chatfile_map:
+            chatfile_map.seek(find_offset(get_time_index_path(history_file), since))
+            return (yield from filter_range(iter(chatfile_map.readline, b''), since, until))
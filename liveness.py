@@ -0,0 +1,38 @@
+import time
+
+import anyio
+
+
+class ConnectionTimedOut:
+    def __init__(self, connection, idle_time):
+        self.connection = connection
+        self.idle_time = idle_time
+
+    def __str__(self):
+        return f'{self.connection} connection timed out: no activity for {self.idle_time:.1f} s'
+
+
+class LivenessMonitor:
+    def __init__(self):
+        self.last_activity_at = {}
+
+    def touch(self, connection):
+        self.last_activity_at[connection] = time.monotonic()
+
+    def idle_time(self, connection):
+        return time.monotonic() - self.last_activity_at[connection]
+
+    async def watch(self, connection, deadline, events_queue, suspect_after=None, on_suspect=None):
+        self.touch(connection)
+        suspected = False
+        while (idle_time := self.idle_time(connection)) < deadline:
+            if not on_suspect or idle_time < suspect_after:
+                suspected = False
+                await anyio.sleep((suspect_after if on_suspect else deadline) - idle_time)
+                continue
+            if not suspected:
+                suspected = True
+                on_suspect()
+            await anyio.sleep(deadline - idle_time)
+        events_queue.put_nowait(ConnectionTimedOut(connection, idle_time))
+        raise ConnectionError(f'{connection} connection timed out')
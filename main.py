@@ -1,13 +1,21 @@
 import argparse
 import asyncio
 import logging
-from contextlib import suppress
+from contextlib import nullcontext, suppress
 
 import anyio
 from environs import Env
 
 import gui_main
 import minechat
+from chat_protocol import DNS_CACHE_TTL, STABLE_CONNECTION_TIME, address_cache
+from chat_stats import ChatStats, dump_stats, get_stats_path, report_stats, save_stats
+from credentials import DEFAULT_CREDENTIALS_FILE, CredentialsStore
+from history import HistoryWriter, history_writer_options
+from history_index import HistoryIndex
+from history_time_index import parse_datetime
+from metrics import Metrics, SamplingProfiler, dump_metrics, serve_metrics
+from queues import BoundedQueue, QueuePolicy, log_queue_stats
 
 
 async def main():
@@ -26,49 +34,169 @@ async def main():
 
     parser = argparse.ArgumentParser(description='Underground chat with gui')
     parser.add_argument('--host', '-s', help='Host')
+    parser.add_argument('--readinghost', '-rs', help='Reading host, e.g. a local relay; defaults to --host')
     parser.add_argument('--readingport', '-rp', type=int, help='Reading port')
     parser.add_argument('--writingport', '-wp', type=int, help='Writing port')
     parser.add_argument('--token', '-t', help='Chat token')
     parser.add_argument('--nickname', '-n', help='Chat nickname')
     parser.add_argument('--historyfile', '-f', help='File for history')
+    parser.add_argument('--historylines', '-l', type=int, help='History lines to restore at once')
+    parser.add_argument('--since', type=parse_datetime, help='Restore history since this time, e.g. 2024-02-01T14:00')
+    parser.add_argument('--until', type=parse_datetime, help='Restore history until this time, e.g. 2024-02-01T15:00')
     args = parser.parse_args()
 
+    host = args.host or env('HOST', default='minechat.dvmn.org')
     config = {
-        'host': args.host or env('HOST', default='minechat.dvmn.org'),
+        'host': host,
+        'reading_host': args.readinghost or env('READING_HOST', default=host),
         'reading_port': args.readingport or env.int('READING_PORT', default=5000),
         'writing_port': args.writingport or env.int('WRITING_PORT', default=5050),
         'token': args.token or env('CHAT_TOKEN', default=''),
         'nickname': args.nickname or env('CHAT_NICKNAME', default=''),
         'history_file': args.historyfile or env('HISTORY_FILE', default='minechat.history'),
+        'history_lines': args.historylines or env.int('HISTORY_LINES', default=1000),
+        'history_batch_size': env.int('HISTORY_BATCH_SIZE', default=100),
+        'history_flush_interval': env.float('HISTORY_FLUSH_INTERVAL', default=0.5),
+        'history_writer_options': history_writer_options(env),
+        'chat_stats': env.bool('CHAT_STATS', default=False),
+        'chat_stats_file': env('CHAT_STATS_FILE', default=''),
+        'chat_stats_interval': env.float('CHAT_STATS_INTERVAL', default=60),
+        'history_since': args.since,
+        'history_until': args.until,
+        'scrollback_lines': env.int('SCROLLBACK_LINES', default=5000),
+        'scrollback_buffer_lines': env.int('SCROLLBACK_BUFFER_LINES', default=20000),
+        'tk_update_mode': gui_main.TkUpdateMode(env('TK_UPDATE_MODE', default='adaptive')),
+        'send_rate': env.float('SEND_RATE', default=5),
+        'send_burst': env.int('SEND_BURST', default=10),
+        'ping_interval': env.float('PING_INTERVAL', default=5),
+        'reconnect_base_delay': env.float('RECONNECT_BASE_DELAY', default=0.5),
+        'reconnect_stable_time': env.float('RECONNECT_STABLE_TIME', default=STABLE_CONNECTION_TIME),
+        'dns_cache_ttl': env.float('DNS_CACHE_TTL', default=DNS_CACHE_TTL),
+        'reading_timeout': env.float('READING_TIMEOUT', default=0),
         'small_reconnect_timeout': env.int('SMALL_RECONNECT_TIMEOUT', default=3),
-        'big_reconnect_timeout': env.int('BIG_RECONNECT_TIMEOUT', default=10)
+        'big_reconnect_timeout': env.int('BIG_RECONNECT_TIMEOUT', default=10),
+        'replay_window': env.int('REPLAY_WINDOW', default=1000),
+        'messages_queue_size': env.int('MESSAGES_QUEUE_SIZE', default=10000),
+        'history_queue_size': env.int('HISTORY_QUEUE_SIZE', default=10000),
+        'sending_queue_size': env.int('SENDING_QUEUE_SIZE', default=1000),
+        'events_queue_size': env.int('EVENTS_QUEUE_SIZE', default=1000),
+        'queue_stats_interval': env.float('QUEUE_STATS_INTERVAL', default=60),
+        'metrics_host': env('METRICS_HOST', default='127.0.0.1'),
+        'metrics_port': env.int('METRICS_PORT', default=0),
+        'metrics_dump_file': env('METRICS_DUMP_FILE', default=''),
+        'metrics_dump_interval': env.float('METRICS_DUMP_INTERVAL', default=10),
+        'profile_file': env('PROFILE_FILE', default=''),
+        'profile_interval': env.float('PROFILE_INTERVAL', default=0.01)
     }
 
-    messages_queue = asyncio.Queue()
-    sending_queue = asyncio.Queue()
-    history_queue = asyncio.Queue()
-    status_updates_queue = asyncio.Queue()
-    watchdog_queue = asyncio.Queue()
+    if not config['token'] and config['nickname']:
+        credentials_store = CredentialsStore(env('CREDENTIALS_FILE', default=DEFAULT_CREDENTIALS_FILE)).load()
+        config['token'] = credentials_store.find_token(config['host'], config['nickname']) or ''
 
-    await minechat.restore_messages(config['history_file'], messages_queue)
+    address_cache.ttl = config['dns_cache_ttl']
 
-    try:
-        async with anyio.create_task_group() as tg:
-            tg.start_soon(gui_main.draw, messages_queue, sending_queue, status_updates_queue)
-            tg.start_soon(minechat.save_messages, config['history_file'], history_queue)
-            tg.start_soon(
-                minechat.handle_connection,
-                config,
-                messages_queue,
-                sending_queue,
-                history_queue,
-                status_updates_queue,
-                watchdog_queue
-            )
-    except minechat.InvalidToken:
-        await gui_main.show_token_error()
-    finally:
-        tg.cancel_scope.cancel()
+    messages_queue = BoundedQueue(
+        'messages',
+        config['messages_queue_size'],
+        QueuePolicy.DROP_OLDEST,
+        keep_types=(gui_main.OlderMessagesLoaded,)
+    )
+    sending_queue = BoundedQueue('sending', config['sending_queue_size'])
+    history_queue = BoundedQueue('history', config['history_queue_size'])
+    status_updates_queue = BoundedQueue('status_updates', config['events_queue_size'], QueuePolicy.DROP_OLDEST)
+    watchdog_queue = BoundedQueue('watchdog', config['events_queue_size'], QueuePolicy.DROP_OLDEST)
+    history_requests_queue = asyncio.Queue()
+    queues = (messages_queue, sending_queue, history_queue, status_updates_queue, watchdog_queue)
+
+    metrics = None
+    if config['metrics_port'] or config['metrics_dump_file']:
+        metrics = Metrics()
+        metrics.register_queues(queues)
+    chat_stats = None
+    if config['chat_stats']:
+        chat_stats = ChatStats(config['chat_stats_file'] or get_stats_path(config['history_file'])).load()
+    profiler = nullcontext()
+    if config['profile_file']:
+        profiler = SamplingProfiler(config['profile_file'], config['profile_interval'])
+
+    history_reader = await minechat.restore_messages(
+        config['history_file'],
+        messages_queue,
+        config['history_lines'],
+        config['history_since'],
+        config['history_until']
+    )
+
+    history_writer = HistoryWriter(config['history_file'], **config['history_writer_options'])
+    history_index = None
+    if config['history_writer_options']['indexed']:
+        history_index = HistoryIndex(config['history_file']).open()
+    with profiler:
+        async with history_writer:
+            try:
+                async with anyio.create_task_group() as tg:
+                    tg.start_soon(
+                        gui_main.draw,
+                        messages_queue,
+                        sending_queue,
+                        status_updates_queue,
+                        history_requests_queue,
+                        config['scrollback_lines'],
+                        config['scrollback_buffer_lines'],
+                        config['history_lines'],
+                        config['tk_update_mode'],
+                        history_index,
+                        metrics
+                    )
+                    tg.start_soon(
+                        minechat.save_messages,
+                        history_writer,
+                        history_queue,
+                        config['history_batch_size'],
+                        config['history_flush_interval'],
+                        metrics,
+                        chat_stats
+                    )
+                    tg.start_soon(
+                        minechat.serve_history_pages,
+                        history_reader,
+                        history_requests_queue,
+                        messages_queue,
+                        config['history_lines']
+                    )
+                    tg.start_soon(
+                        minechat.handle_connection,
+                        config,
+                        messages_queue,
+                        sending_queue,
+                        history_queue,
+                        status_updates_queue,
+                        watchdog_queue,
+                        metrics
+                    )
+                    tg.start_soon(
+                        log_queue_stats,
+                        queues,
+                        config['queue_stats_interval']
+                    )
+                    if chat_stats:
+                        tg.start_soon(dump_stats, chat_stats, config['chat_stats_interval'])
+                        tg.start_soon(report_stats, chat_stats, status_updates_queue)
+                    if config['metrics_port']:
+                        tg.start_soon(serve_metrics, metrics, config['metrics_host'], config['metrics_port'])
+                    if config['metrics_dump_file']:
+                        tg.start_soon(
+                            dump_metrics,
+                            metrics,
+                            config['metrics_dump_file'],
+                            config['metrics_dump_interval']
+                        )
+            except minechat.InvalidToken:
+                await gui_main.show_token_error()
+            finally:
+                tg.cancel_scope.cancel()
+                if chat_stats:
+                    await save_stats(chat_stats)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+import datetime
+import time
+from functools import lru_cache
+
+HISTORY_DATETIME_FORMAT = '%d.%m.%y %H:%M'
+
+
+class Message:
+    __slots__ = ('timestamp', 'nickname', 'text', 'source')
+
+    def __init__(self, timestamp, nickname, text, source=''):
+        self.timestamp = timestamp
+        self.nickname = nickname
+        self.text = text
+        self.source = source
+
+    def __repr__(self):
+        return f'Message({self.timestamp!r}, {self.nickname!r}, {self.text!r}, {self.source!r})'
+
+
+class DatetimeStamp:
+    def __init__(self):
+        self.second = None
+        self.stamp = b''
+
+    def get(self):
+        second = int(time.time())
+        if second != self.second:
+            self.second = second
+            self.stamp = datetime.datetime.fromtimestamp(second).strftime(f'[{HISTORY_DATETIME_FORMAT}] ').encode()
+        return self.stamp
+
+
+def add_datetime(lines, datetime_stamp):
+    stamp = datetime_stamp.get()
+    return b''.join(stamp + line.rstrip() + b'\n' for line in lines if line.strip())
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(stamp):
+    try:
+        return int(datetime.datetime.strptime(stamp.decode(), HISTORY_DATETIME_FORMAT).timestamp())
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def split_timestamp(line):
+    if line.startswith(b'['):
+        stamp_end = line.find(b'] ')
+        if stamp_end != -1:
+            timestamp = parse_timestamp(line[1:stamp_end])
+            if timestamp is not None:
+                return timestamp, line[stamp_end + 2:]
+    return None, line
+
+
+def split_line(line):
+    timestamp, line = split_timestamp(line)
+    nickname, separator, text = line.partition(b': ')
+    if not separator:
+        return timestamp, b'', line
+    return timestamp, nickname, text
+
+
+def parse_line(line, source=''):
+    if isinstance(line, str):
+        line = line.encode()
+    timestamp, nickname, text = split_line(line.rstrip(b'\n'))
+    return Message(
+        timestamp,
+        nickname.decode('utf-8', errors='replace'),
+        text.decode('utf-8', errors='replace'),
+        source
+    )
@@ -0,0 +1,197 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import suppress
+from pathlib import Path
+
+import anyio
+
+logger = logging.getLogger('metrics')
+
+METRIC_TYPES = {
+    'minechat_messages_read_total': 'counter',
+    'minechat_messages_sent_total': 'counter',
+    'minechat_replayed_dropped_total': 'counter',
+    'minechat_replay_gaps_total': 'counter',
+    'minechat_reconnects_total': 'counter',
+    'minechat_reconnect_seconds': 'summary',
+    'minechat_send_latency_seconds': 'summary',
+    'minechat_send_queue_depth': 'gauge',
+    'minechat_history_write_seconds': 'summary',
+    'minechat_tk_frame_seconds': 'summary',
+    'minechat_queue_depth': 'gauge',
+    'minechat_queue_high_water': 'gauge',
+    'minechat_queue_dropped_total': 'counter',
+    'minechat_queue_overflowed_total': 'counter',
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = collections.defaultdict(float)
+        self.summaries = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, value, **labels):
+        key = name, tuple(sorted(labels.items()))
+        count, total, maximum = self.summaries.get(key, (0, 0, 0))
+        self.summaries[key] = (count + 1, total + value, max(maximum, value))
+
+    def register_gauge(self, name, func, **labels):
+        self.gauges[name, tuple(sorted(labels.items()))] = func
+
+    def register_queues(self, queues):
+        for queue in queues:
+            self.register_gauge('minechat_queue_depth', queue.qsize, queue=queue.name)
+            self.register_gauge('minechat_queue_high_water', lambda queue=queue: queue.high_water, queue=queue.name)
+            self.register_gauge('minechat_queue_dropped_total', lambda queue=queue: queue.dropped, queue=queue.name)
+            self.register_gauge(
+                'minechat_queue_overflowed_total',
+                lambda queue=queue: queue.overflowed,
+                queue=queue.name
+            )
+
+    def collect(self):
+        samples = sorted((name, labels, value) for (name, labels), value in self.counters.items())
+        samples.extend(sorted((name, labels, func()) for (name, labels), func in self.gauges.items()))
+        maximums = []
+        for (name, labels), (count, total, maximum) in sorted(self.summaries.items()):
+            samples.append((f'{name}_count', labels, count))
+            samples.append((f'{name}_sum', labels, total))
+            maximums.append((f'{name}_max', labels, maximum))
+        return samples + maximums
+
+    def render_prometheus(self):
+        lines = []
+        typed = set()
+        for name, labels, value in self.collect():
+            metric_name = name.removesuffix('_count').removesuffix('_sum')
+            if metric_name not in METRIC_TYPES:
+                metric_name = name
+            if metric_name not in typed:
+                lines.append(f'# TYPE {metric_name} {METRIC_TYPES.get(metric_name, "gauge")}')
+                typed.add(metric_name)
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def take_snapshot(self):
+        return {
+            f'{name}{format_labels(labels)}': value
+            for name, labels, value in self.collect()
+        }
+
+
+async def handle_metrics_request(metrics, reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        if request_line.split()[1:2] == [b'/metrics']:
+            status, body = '200 OK', metrics.render_prometheus()
+        else:
+            status, body = '404 Not Found', 'Not found\n'
+        body = body.encode()
+        writer.write(
+            f'HTTP/1.0 {status}\r\n'
+            f'Content-Type: text/plain; version=0.0.4\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(metrics, host, port):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_metrics_request(metrics, reader, writer),
+        host,
+        port
+    )
+    logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+    async with server:
+        await anyio.sleep_forever()
+
+
+def write_snapshot(filepath, snapshot):
+    filepath = Path(filepath)
+    temporary_path = filepath.with_name(f'{filepath.name}.tmp')
+    with open(temporary_path, 'w', encoding='utf-8') as dump_file:
+        json.dump(snapshot, dump_file, ensure_ascii=False, indent=2)
+    os.replace(temporary_path, filepath)
+
+
+async def dump_metrics(metrics, filepath, interval):
+    previous = metrics.take_snapshot()
+    previous_at = time.monotonic()
+    while True:
+        await anyio.sleep(interval)
+        current = metrics.take_snapshot()
+        current_at = time.monotonic()
+        elapsed = current_at - previous_at
+        rates = {
+            name: (value - previous.get(name, 0)) / elapsed
+            for name, value in current.items()
+            if name.split('{')[0].endswith('_total')
+        }
+        snapshot = {'timestamp': time.time(), 'metrics': current, 'rates': rates}
+        await anyio.to_thread.run_sync(write_snapshot, filepath, snapshot)
+        previous, previous_at = current, current_at
+
+
+class SamplingProfiler:
+    def __init__(self, output_path, interval=0.01):
+        self.output_path = output_path
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name='sampling-profiler', daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame:
+                code = frame.f_code
+                stack.append(f'{Path(code.co_filename).name}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def save(self):
+        with open(self.output_path, 'w', encoding='utf-8') as profile_file:
+            for stack, count in self.stacks.most_common():
+                profile_file.write(f'{stack} {count}\n')
+
+    def __enter__(self):
+        self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.sampler.join()
+        with suppress(OSError):
+            self.save()
+        logger.info(f'Saved {sum(self.stacks.values())} profile samples to {self.output_path}')
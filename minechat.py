@@ -1,15 +1,25 @@
 import asyncio
-import json
 import logging
-import socket
-from contextlib import asynccontextmanager
-from pathlib import Path
+import time
+from functools import partial
 
-import aiofiles
 import anyio
-from async_timeout import timeout
 
-import gui_main
+import events
+from chat_protocol import (
+    Backoff,
+    get_connection,
+    prewarm_connection,
+    read_lines,
+    sign_in,
+    submit_message,
+    submit_messages,
+)
+from history import HistoryReader, read_history_range
+from liveness import LivenessMonitor
+from messages import DatetimeStamp, add_datetime
+from replay_filter import ReplayFilter
+from send_scheduler import SendScheduler
 
 logger = logging.getLogger('minechat')
 watchdog_logger = logging.getLogger('minechat_watchdog')
@@ -19,90 +29,236 @@ class InvalidToken(Exception):
     pass
 
 
-@asynccontextmanager
-async def get_connection(host, port):
-    reader, writer = await asyncio.open_connection(host, port)
-    try:
-        yield reader, writer
-    finally:
-        writer.close()
-        await writer.wait_closed()
-
+CONNECTION_CLOSED_EVENTS = {
+    'Reading': events.ReadConnectionStateChanged.CLOSED,
+    'Sending': events.SendingConnectionStateChanged.CLOSED,
+}
+
+CONNECTION_HOSTS = {
+    'Reading': 'reading_host',
+    'Sending': 'host',
+}
+CONNECTION_PORTS = {
+    'Reading': 'reading_port',
+    'Sending': 'writing_port',
+}
+
+PREWARM_AFTER = 0.75
+
+
+async def handle_connection(
+    config,
+    messages_queue,
+    sending_queue,
+    history_queue,
+    status_updates_queue,
+    watchdog_queue,
+    metrics=None
+):
+    send_scheduler = SendScheduler(sending_queue, config['send_rate'], config['send_burst'])
+    if metrics:
+        metrics.register_gauge('minechat_send_queue_depth', lambda: send_scheduler.queue_depth)
+    liveness_monitor = LivenessMonitor()
+    replay_filter = ReplayFilter(config['replay_window']) if config['replay_window'] else None
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(log_liveness_events, watchdog_queue)
+        tg.start_soon(
+            keep_connected,
+            config,
+            'Reading',
+            config['reading_timeout'],
+            liveness_monitor,
+            watchdog_queue,
+            status_updates_queue,
+            metrics,
+            read_messages,
+            config,
+            messages_queue,
+            history_queue,
+            status_updates_queue,
+            liveness_monitor,
+            replay_filter,
+            metrics
+        )
+        tg.start_soon(
+            keep_connected,
+            config,
+            'Sending',
+            config['ping_interval'] + config['small_reconnect_timeout'],
+            liveness_monitor,
+            watchdog_queue,
+            status_updates_queue,
+            metrics,
+            send_messages,
+            config,
+            send_scheduler,
+            messages_queue,
+            status_updates_queue,
+            liveness_monitor,
+            metrics
+        )
+
+
+async def keep_connected(
+    config,
+    name,
+    deadline,
+    liveness_monitor,
+    watchdog_queue,
+    status_updates_queue,
+    metrics,
+    connection_func,
+    *args
+):
+    closed_event = CONNECTION_CLOSED_EVENTS[name]
+    prewarm = partial(prewarm_connection, config[CONNECTION_HOSTS[name]], config[CONNECTION_PORTS[name]])
+    backoff = Backoff(
+        config['reconnect_base_delay'],
+        config['big_reconnect_timeout'],
+        config['reconnect_stable_time']
+    )
+    lost_at = None
+
+    def on_connected():
+        backoff.mark_connected()
+        if metrics and lost_at is not None:
+            metrics.observe('minechat_reconnect_seconds', time.monotonic() - lost_at, connection=name)
 
-async def handle_connection(config, messages_queue, sending_queue, history_queue, status_updates_queue, watchdog_queue):
     while True:
         try:
             async with anyio.create_task_group() as tg:
-                tg.start_soon(
-                    read_messages,
-                    config,
-                    messages_queue,
-                    history_queue,
-                    status_updates_queue,
-                    watchdog_queue
-                )
-                tg.start_soon(
-                    send_messages,
-                    config,
-                    sending_queue,
-                    messages_queue,
-                    status_updates_queue,
-                    watchdog_queue
-                )
-                tg.start_soon(ping_pong, config, status_updates_queue, watchdog_queue)
-                tg.start_soon(watch_for_connection, watchdog_queue)
-        except (socket.gaierror, anyio.ExceptionGroup):
-            tg.cancel_scope.cancel()
-            logger.info('Reconnecting with big timeout')
-            await anyio.sleep(config['big_reconnect_timeout'])
-        except (ConnectionError):
-            tg.cancel_scope.cancel()
-            logger.info('Reconnecting with small timeout')
-            await anyio.sleep(config['small_reconnect_timeout'])
-
-
-async def ping_pong(config, status_updates_queue, watchdog_queue):
-    async with get_connection(config['host'], config['writing_port']) as (reader, writer):
-        while True:
-            await submit_message(writer, '')
-            try:
-                async with timeout(config['small_reconnect_timeout']) as cm:
-                    await reader.readline()
-                    status_updates_queue.put_nowait(gui_main.SendingConnectionStateChanged.ESTABLISHED)
-            except asyncio.exceptions.TimeoutError:
-                if cm.expired:
-                    watchdog_queue.put_nowait('Small timeout is elapsed')
-
-
-async def read_messages(config, messages_queue, history_queue, status_updates_queue, watchdog_queue):
-    status_updates_queue.put_nowait(gui_main.ReadConnectionStateChanged.INITIATED)
-    async with get_connection(config['host'], config['reading_port']) as (reader, writer):
-        while not reader.at_eof():
-            message = await reader.readline()
-            message = message.decode().strip()
-            messages_queue.put_nowait(message)
-            history_queue.put_nowait(message)
-            watchdog_queue.put_nowait('New message in chat')
-            status_updates_queue.put_nowait(gui_main.ReadConnectionStateChanged.ESTABLISHED)
-
-
-async def restore_messages(filepath, messages_queue):
-    if not Path(filepath).exists():
-        return
-    async with aiofiles.open(filepath, 'r', encoding='utf-8') as chatfile:
-        history = await chatfile.read()
-        messages_queue.put_nowait(history)
-
-
-async def save_messages(filepath, history_queue):
-    async with aiofiles.open(filepath, 'a', encoding='utf-8') as chatfile:
+                if deadline:
+                    tg.start_soon(
+                        liveness_monitor.watch,
+                        name,
+                        deadline,
+                        watchdog_queue,
+                        deadline * PREWARM_AFTER,
+                        prewarm
+                    )
+                await connection_func(*args, on_connected=on_connected)
+                tg.cancel_scope.cancel()
+        except (OSError, asyncio.IncompleteReadError, anyio.ExceptionGroup) as error:
+            logger.info(f'{name} connection lost: {error!r}')
+        lost_at = time.monotonic()
+        if metrics:
+            metrics.inc('minechat_reconnects_total', connection=name)
+        status_updates_queue.put_nowait(closed_event)
+
+        delay = backoff.next_delay()
+        logger.info(f'Reconnecting {name.lower()} connection in {delay:.2f} s')
+        await anyio.sleep(delay)
+
+
+async def read_messages(
+    config,
+    messages_queue,
+    history_queue,
+    status_updates_queue,
+    liveness_monitor,
+    replay_filter=None,
+    metrics=None,
+    on_connected=None,
+    timestamped=True
+):
+    status_updates_queue.put_nowait(events.ReadConnectionStateChanged.INITIATED)
+    async with get_connection(config['reading_host'], config['reading_port']) as (reader, writer):
+        if on_connected:
+            on_connected()
+        status_updates_queue.put_nowait(events.ReadConnectionStateChanged.ESTABLISHED)
+        if replay_filter:
+            replay_filter.start_replay()
+        datetime_stamp = DatetimeStamp()
+        async for lines in read_lines(reader):
+            liveness_monitor.touch('Reading')
+            lines = [line.strip() for line in lines]
+            lines = [line for line in lines if line]
+            if metrics:
+                metrics.inc('minechat_messages_read_total', len(lines))
+            if replay_filter:
+                received_count = len(lines)
+                lines, gap = replay_filter.filter(lines)
+                if metrics:
+                    metrics.inc('minechat_replayed_dropped_total', received_count - len(lines))
+                if gap:
+                    logger.warning('Reading connection restored without replay overlap, messages may be missing')
+                    if messages_queue is not None:
+                        messages_queue.put_nowait('Соединение восстановлено, часть сообщений могла быть пропущена')
+                    if metrics:
+                        metrics.inc('minechat_replay_gaps_total')
+            if not lines:
+                continue
+            if timestamped:
+                await history_queue.put(add_datetime(lines, datetime_stamp))
+            else:
+                await history_queue.put(b''.join(line + b'\n' for line in lines))
+            if messages_queue is None:
+                continue
+            for line in lines:
+                messages_queue.put_nowait(line.decode('utf-8', errors='replace'))
+
+
+async def restore_messages(filepath, messages_queue, lines_count, since=None, until=None):
+    if since is not None or until is not None:
+        history = await anyio.to_thread.run_sync(read_history_range, filepath, since, until)
+        if history:
+            messages_queue.put_nowait('\n'.join(history))
+        return None
+
+    history_reader = HistoryReader(filepath)
+    history = await anyio.to_thread.run_sync(history_reader.read_older, lines_count)
+    if history:
+        messages_queue.put_nowait('\n'.join(history))
+    return history_reader
+
+
+async def serve_history_pages(history_reader, history_requests_queue, messages_queue, lines_count):
+    while True:
+        evicted_lines = await history_requests_queue.get()
+        history = []
+        if history_reader:
+            await anyio.to_thread.run_sync(history_reader.unread, evicted_lines)
+            history = await anyio.to_thread.run_sync(history_reader.read_older, lines_count)
+        messages_queue.put_nowait(events.OlderMessagesLoaded(history))
+
+
+async def save_messages(
+    history_writer,
+    history_queue,
+    batch_size=100,
+    flush_interval=0.5,
+    metrics=None,
+    chat_stats=None
+):
+    try:
         while True:
-            message = await history_queue.get()
-            await chatfile.write(f'{message}\n')
-
-
-async def send_messages(config, sending_queue, messages_queue, status_updates_queue, watchdog_queue):
-    status_updates_queue.put_nowait(gui_main.SendingConnectionStateChanged.INITIATED)
+            history_writer.write(await history_queue.get())
+            with anyio.move_on_after(flush_interval):
+                while len(history_writer.buffer) < batch_size:
+                    history_writer.write(await history_queue.get())
+            if chat_stats:
+                chat_stats.add(history_writer.buffer)
+            flush_started_at = time.perf_counter()
+            await history_writer.flush()
+            if metrics:
+                metrics.observe('minechat_history_write_seconds', time.perf_counter() - flush_started_at)
+    finally:
+        while not history_queue.empty():
+            history_writer.write(history_queue.get_nowait())
+        if chat_stats:
+            chat_stats.add(history_writer.buffer)
+
+
+async def send_messages(
+    config,
+    send_scheduler,
+    messages_queue,
+    status_updates_queue,
+    liveness_monitor,
+    metrics=None,
+    on_connected=None
+):
+    status_updates_queue.put_nowait(events.SendingConnectionStateChanged.INITIATED)
     async with get_connection(config['host'], config['writing_port']) as (reader, writer):
         greeting_query = await reader.readline()
         logger.info(greeting_query.decode().strip())
@@ -110,63 +266,43 @@ async def send_messages(config, sending_queue, messages_queue, status_updates_qu
         credentials = await sign_in(reader, writer, config['token'])
         if not credentials:
             raise InvalidToken
+        if on_connected:
+            on_connected()
         messages_queue.put_nowait(f'Выполнена авторизация. Пользователь {credentials["nickname"]}')
-        event = gui_main.NicknameReceived(credentials['nickname'])
+        event = events.NicknameReceived(credentials['nickname'])
         status_updates_queue.put_nowait(event)
+        status_updates_queue.put_nowait(events.SendingConnectionStateChanged.ESTABLISHED)
+        liveness_monitor.touch('Sending')
 
-        while True:
-            message = await sending_queue.get()
-            await submit_message(writer, message)
-            logger.info(f'Sending "{message}"')
-            watchdog_queue.put_nowait('Message sent')
-            status_updates_queue.put_nowait(gui_main.SendingConnectionStateChanged.ESTABLISHED)
-
-
-async def watch_for_connection(watchdog_queue):
-    while True:
-        message = await watchdog_queue.get()
-        if 'timeout' in message:
-            watchdog_logger.info(message)
-            raise ConnectionError
-        else:
-            watchdog_logger.info(f'Connection is alive. Source: {message}')
-
-
-async def receive_credentials(reader):
-    credentials_response = await reader.readline()
-    credentials = json.loads(credentials_response.decode().strip())
-    logger.info(f'Received {credentials}')
-    return credentials
-
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(read_responses, reader, liveness_monitor)
+            tg.start_soon(keep_alive, config, writer, liveness_monitor)
+            while True:
+                batch = await send_scheduler.next_batch()
+                await submit_messages(writer, [message for _, message in batch])
+                send_scheduler.record_sent(batch)
+                if metrics:
+                    metrics.inc('minechat_messages_sent_total', len(batch))
+                    metrics.observe('minechat_send_latency_seconds', send_scheduler.last_latency)
 
-async def save_token(nickname, token):
-    async with aiofiles.open(f'{nickname}.token', 'w') as tokenfile:
-        await tokenfile.write(token)
 
+async def read_responses(reader, liveness_monitor):
+    while await reader.readline():
+        liveness_monitor.touch('Sending')
+    raise ConnectionError('Sending connection closed by server')
 
-async def sign_in(reader, writer, token):
-    logger.info(f'Sending "{token}"')
-    await write_to_chat(writer, f'{token}\n')
-    return await receive_credentials(reader)
 
-
-async def sign_up(reader, writer, nickname, send_blank=False):
-    nickname_query = await reader.readline()
-    logger.info(nickname_query.decode().strip())
-    if send_blank:
-        await write_to_chat(writer, '\n')
-        nickname_query = await reader.readline()
-        logger.info(nickname_query.decode().strip())
-    logger.info(f'Sending "{nickname}"')
-    await write_to_chat(writer, f'{nickname}\n')
-    return await receive_credentials(reader)
-
-
-async def submit_message(writer, message):
-    message = message.replace('\n', ' ')
-    await write_to_chat(writer, f'{message}\n\n')
+async def keep_alive(config, writer, liveness_monitor):
+    while True:
+        idle_time = liveness_monitor.idle_time('Sending')
+        if idle_time < config['ping_interval']:
+            await anyio.sleep(config['ping_interval'] - idle_time)
+            continue
+        await submit_message(writer, '')
+        await anyio.sleep(config['ping_interval'])
 
 
-async def write_to_chat(writer, message):
-    writer.write(message.encode())
-    await writer.drain()
+async def log_liveness_events(watchdog_queue):
+    while True:
+        event = await watchdog_queue.get()
+        watchdog_logger.info(event)
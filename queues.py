@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from enum import Enum
+
+import anyio
+
+logger = logging.getLogger('queues')
+
+
+class QueuePolicy(Enum):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+
+
+class BoundedQueue(asyncio.Queue):
+    def __init__(self, name, maxsize=0, policy=QueuePolicy.BLOCK, keep_types=()):
+        super().__init__(maxsize)
+        self.name = name
+        self.policy = policy
+        self.keep_types = keep_types
+        self.dropped = 0
+        self.overflowed = 0
+        self.high_water = 0
+
+    def put_nowait(self, item):
+        if self.policy == QueuePolicy.DROP_OLDEST and self.full() and not self.drop_oldest():
+            if not isinstance(item, self.keep_types):
+                self.dropped += 1
+                return
+            self.overflowed += 1
+            self.put_past_bound(item)
+        else:
+            super().put_nowait(item)
+        self.high_water = max(self.high_water, self.qsize())
+
+    def drop_oldest(self):
+        for index, item in enumerate(self._queue):
+            if not isinstance(item, self.keep_types):
+                del self._queue[index]
+                self.dropped += 1
+                self.task_done()
+                return True
+        return False
+
+    def put_past_bound(self, item):
+        self._put(item)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next(self._getters)
+
+    def take_report(self):
+        maxsize = self.maxsize or '∞'
+        return (
+            f'{self.name}: {self.qsize()}/{maxsize}, high water {self.high_water}, '
+            f'dropped {self.dropped}, overflowed {self.overflowed}'
+        )
+
+
+async def log_queue_stats(queues, interval):
+    reported = {}
+    while True:
+        await anyio.sleep(interval)
+        for queue in queues:
+            counters = (queue.high_water, queue.dropped, queue.overflowed)
+            if reported.get(queue.name) != counters:
+                logger.info(queue.take_report())
+                reported[queue.name] = counters
@@ -1,24 +1,62 @@
 import argparse
 import asyncio
-import datetime
+import sys
 
-import aiofiles
+import anyio
 from environs import Env
 
-from minechat import get_connection
+from chat_protocol import get_connection, read_lines
+from chat_stats import ChatStats, dump_stats, get_stats_path, save_stats
+from history import HistoryWriter, history_writer_options
+from messages import DatetimeStamp, add_datetime
+from minechat import save_messages
 
 
-async def read_chat(host, port, history_file):
-    async with (
-        aiofiles.open(history_file, 'a') as chatfile,
-        get_connection(host, port) as (reader, writer)
-    ):
-        while not reader.at_eof():
-            message = await reader.readline()
-            now = datetime.datetime.now()
-            message_with_datetime = f'[{now.strftime("%d.%m.%y %H:%M")}] {message.decode()}'
-            print(message_with_datetime, end='')
-            await chatfile.write(message_with_datetime)
+async def read_messages(host, port, history_queue, quiet=False):
+    datetime_stamp = DatetimeStamp()
+    async with get_connection(host, port) as (reader, writer):
+        async for lines in read_lines(reader):
+            messages = add_datetime(lines, datetime_stamp)
+            if not messages:
+                continue
+            if not quiet:
+                sys.stdout.buffer.write(messages)
+                sys.stdout.buffer.flush()
+            history_queue.put_nowait(messages)
+
+
+async def read_chat(
+    host,
+    port,
+    history_file,
+    batch_size,
+    flush_interval,
+    history_writer_options,
+    quiet=False,
+    stats_file=None,
+    stats_interval=60
+):
+    history_queue = asyncio.Queue()
+    chat_stats = ChatStats(stats_file).load() if stats_file else None
+    async with HistoryWriter(history_file, **history_writer_options) as history_writer:
+        try:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(
+                    save_messages,
+                    history_writer,
+                    history_queue,
+                    batch_size,
+                    flush_interval,
+                    None,
+                    chat_stats
+                )
+                if chat_stats:
+                    tg.start_soon(dump_stats, chat_stats, stats_interval)
+                await read_messages(host, port, history_queue, quiet)
+                tg.cancel_scope.cancel()
+        finally:
+            if chat_stats:
+                await save_stats(chat_stats)
 
 
 def main():
@@ -29,14 +67,24 @@ def main():
     parser.add_argument('--host', '-s', help='Host')
     parser.add_argument('--port', '-p', type=int, help='Port')
     parser.add_argument('--historyfile', '-f', help='File for history')
+    parser.add_argument('--quiet', '-q', action='store_true', help='Only save messages, do not print them')
     args = parser.parse_args()
 
     minechat_config = {
         'host': args.host or env('HOST', default='minechat.dvmn.org'),
         'port': args.port or env.int('READING_PORT', default=5000),
-        'history_file': args.historyfile or env('HISTORY_FILE', default='minechat.history')
+        'history_file': args.historyfile or env('HISTORY_FILE', default='minechat.history'),
+        'batch_size': env.int('HISTORY_BATCH_SIZE', default=100),
+        'flush_interval': env.float('HISTORY_FLUSH_INTERVAL', default=0.5),
+        'quiet': args.quiet,
+        'stats_interval': env.float('CHAT_STATS_INTERVAL', default=60),
+        'history_writer_options': history_writer_options(env),
     }
 
+    if env.bool('CHAT_STATS', default=False):
+        stats_file = env('CHAT_STATS_FILE', default='') or get_stats_path(minechat_config['history_file'])
+        minechat_config['stats_file'] = stats_file
+
     asyncio.run(read_chat(**minechat_config))
 
 
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import time
+from contextlib import AsyncExitStack, suppress
+
+import anyio
+from environs import Env
+
+from history import HistoryWriter, flush_writers, history_writer_options
+from chat_protocol import Backoff, get_connection, read_lines
+from messages import DatetimeStamp, add_datetime
+from replay_filter import ReplayFilter
+
+logger = logging.getLogger('read_daemon')
+
+
+class EndpointStats:
+    def __init__(self, name):
+        self.name = name
+        self.connected = False
+        self.received = 0
+        self.written = 0
+        self.reconnects = 0
+        self.max_lag = 0
+        self.reported_received = 0
+
+    def take_report(self, interval):
+        rate = (self.received - self.reported_received) / interval
+        report = (
+            f'{self.name}: {"online" if self.connected else "offline"}, {rate:.1f} msg/s, '
+            f'written {self.written}/{self.received}, lag {self.max_lag * 1000:.0f} ms, '
+            f'reconnects {self.reconnects}'
+        )
+        self.reported_received = self.received
+        self.max_lag = 0
+        return report
+
+
+def load_endpoints(config_file):
+    with open(config_file, encoding='utf-8') as file:
+        endpoints = json.load(file)['endpoints']
+    for endpoint in endpoints:
+        endpoint.setdefault('name', f'{endpoint["host"]}:{endpoint["port"]}')
+        endpoint.setdefault('history_file', f'{endpoint["name"]}.history')
+    return endpoints
+
+
+async def read_endpoint(endpoint, history_queue, stats):
+    backoff = Backoff()
+    datetime_stamp = DatetimeStamp()
+    replay_filter = ReplayFilter(endpoint.get('replay_window', 1000))
+    while True:
+        try:
+            async with get_connection(endpoint['host'], endpoint['port']) as (reader, writer):
+                stats.connected = True
+                backoff.mark_connected()
+                replay_filter.start_replay()
+                async for lines in read_lines(reader):
+                    lines, gap = replay_filter.filter([line.strip() for line in lines if line.strip()])
+                    if gap:
+                        logger.warning(f'{endpoint["name"]}: no replay overlap, messages may be missing')
+                    messages = add_datetime(lines, datetime_stamp)
+                    if not messages:
+                        continue
+                    count = messages.count(b'\n')
+                    stats.received += count
+                    await history_queue.put((endpoint['name'], time.monotonic(), messages, count))
+        except (OSError, socket.gaierror, asyncio.IncompleteReadError) as error:
+            logger.info(f'{endpoint["name"]}: connection lost ({error!r})')
+        stats.connected = False
+        stats.reconnects += 1
+        await anyio.sleep(backoff.next_delay())
+
+
+async def save_endpoint_messages(history_writers, history_queue, endpoints_stats, batch_size, flush_interval):
+    while True:
+        name, received_at, messages, count = await history_queue.get()
+        history_writers[name].write(messages)
+        received = [(name, received_at, count)]
+        received_count = count
+        with anyio.move_on_after(flush_interval):
+            while received_count < batch_size:
+                name, received_at, messages, count = await history_queue.get()
+                history_writers[name].write(messages)
+                received.append((name, received_at, count))
+                received_count += count
+
+        await flush_writers(history_writers.values())
+
+        flushed_at = time.monotonic()
+        for name, received_at, count in received:
+            stats = endpoints_stats[name]
+            stats.written += count
+            stats.max_lag = max(stats.max_lag, flushed_at - received_at)
+
+
+async def report_stats(endpoints_stats, history_queue, interval):
+    while True:
+        await anyio.sleep(interval)
+        logger.info(f'Queue size: {history_queue.qsize()}')
+        for stats in endpoints_stats.values():
+            logger.info(stats.take_report(interval))
+
+
+async def run_daemon(endpoints, history_writer_options, batch_size, flush_interval, report_interval):
+    history_queue = asyncio.Queue(maxsize=batch_size * 10)
+    endpoints_stats = {endpoint['name']: EndpointStats(endpoint['name']) for endpoint in endpoints}
+
+    async with AsyncExitStack() as stack:
+        history_writers = {}
+        for endpoint in endpoints:
+            history_writer = HistoryWriter(endpoint['history_file'], **history_writer_options)
+            history_writers[endpoint['name']] = await stack.enter_async_context(history_writer)
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(
+                save_endpoint_messages,
+                history_writers,
+                history_queue,
+                endpoints_stats,
+                batch_size,
+                flush_interval
+            )
+            tg.start_soon(report_stats, endpoints_stats, history_queue, report_interval)
+            for endpoint in endpoints:
+                tg.start_soon(read_endpoint, endpoint, history_queue, endpoints_stats[endpoint['name']])
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    env = Env()
+    env.read_env()
+
+    parser = argparse.ArgumentParser(description='Read many chats at once and save messages to files')
+    parser.add_argument('--config', '-c', help='JSON file with endpoints list')
+    parser.add_argument('--reportinterval', '-r', type=float, help='Seconds between stats reports')
+    args = parser.parse_args()
+
+    endpoints = load_endpoints(args.config or env('READ_DAEMON_CONFIG', default='endpoints.json'))
+    daemon_config = {
+        'endpoints': endpoints,
+        'batch_size': env.int('HISTORY_BATCH_SIZE', default=100),
+        'flush_interval': env.float('HISTORY_FLUSH_INTERVAL', default=0.5),
+        'report_interval': args.reportinterval or env.float('READ_DAEMON_REPORT_INTERVAL', default=60),
+        'history_writer_options': {
+            **history_writer_options(env),
+            'indexed': env.bool('READ_DAEMON_HISTORY_INDEX', default=False),
+        },
+    }
+
+    with suppress(KeyboardInterrupt):
+        asyncio.run(run_daemon(**daemon_config))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,83 @@
 import argparse
 import asyncio
+import logging
 from contextlib import suppress
 
 import anyio
 from environs import Env
 
 import gui_reg
-from minechat import get_connection, sign_up, save_token
+from credentials import DEFAULT_CREDENTIALS_FILE, CredentialsStore
+from chat_protocol import get_connection, save_token, sign_up
+
+logger = logging.getLogger('reg')
+
+
+async def register(config, nickname):
+    async with get_connection(config['host'], config['writing_port']) as (reader, writer):
+        credentials = await sign_up(reader, writer, nickname, send_blank=True)
+    config['credentials_store'].remember(config['host'], credentials)
+    await save_token(credentials['nickname'], credentials['account_hash'])
+    return credentials
 
 
 async def watch_events(config, events_queue):
     while True:
         nickname = await events_queue.get()
-        async with get_connection(config['host'], config['writing_port']) as (reader, writer):
-            credentials = await sign_up(reader, writer, nickname, send_blank=True)
-        await save_token(credentials['nickname'], credentials['account_hash'])
+        credentials = await register(config, nickname)
+        await anyio.to_thread.run_sync(config['credentials_store'].save)
         await gui_reg.show_success(credentials['nickname'])
 
 
+async def register_many(config, nicknames, concurrency):
+    credentials_store = config['credentials_store']
+    limiter = anyio.CapacityLimiter(concurrency)
+
+    async def register_limited(nickname):
+        async with limiter:
+            await register(config, nickname)
+        logger.info(f'Registered {nickname}')
+
+    try:
+        async with anyio.create_task_group() as tg:
+            for nickname in dict.fromkeys(nicknames):
+                if credentials_store.find_token(config['host'], nickname):
+                    logger.info(f'{nickname} is already registered on {config["host"]}')
+                    continue
+                tg.start_soon(register_limited, nickname)
+    finally:
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(credentials_store.save)
+
+
 async def main():
+    logging.basicConfig(level=logging.INFO)
+
     env = Env()
     env.read_env()
 
     parser = argparse.ArgumentParser(description='Registration in underground chat')
+    parser.add_argument('nicknames', nargs='*', help='Register nicknames without gui')
     parser.add_argument('--host', '-s', help='Host')
     parser.add_argument('--writingport', '-wp', type=int, help='Writing port')
+    parser.add_argument('--file', '-f', help='Register every line of file as a nickname without gui')
+    parser.add_argument('--concurrency', '-c', type=int, default=10, help='Simultaneous registrations')
     args = parser.parse_args()
 
     config = {
         'host': args.host or env('HOST', default='minechat.dvmn.org'),
-        'writing_port': args.writingport or env.int('WRITING_PORT', default=5050)
+        'writing_port': args.writingport or env.int('WRITING_PORT', default=5050),
+        'credentials_store': CredentialsStore(env('CREDENTIALS_FILE', default=DEFAULT_CREDENTIALS_FILE)).load()
     }
 
+    nicknames = list(args.nicknames)
+    if args.file:
+        with open(args.file, encoding='utf-8') as file:
+            nicknames.extend(line.strip() for line in file if line.strip())
+    if nicknames:
+        await register_many(config, nicknames, args.concurrency)
+        return
+
     events_queue = asyncio.Queue()
 
     try:
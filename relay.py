@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import logging
+from collections import deque
+from contextlib import suppress
+from functools import partial
+from pathlib import Path
+
+import anyio
+from environs import Env
+
+import minechat
+from chat_protocol import STABLE_CONNECTION_TIME
+from liveness import LivenessMonitor
+from queues import BoundedQueue, QueuePolicy
+from replay_filter import ReplayFilter
+
+logger = logging.getLogger('relay')
+
+
+class Relay:
+    def __init__(self, buffer_size=1000, backlog_size=0):
+        self.buffer_size = buffer_size
+        self.backlog = deque(maxlen=backlog_size)
+        self.subscribers = set()
+
+    def broadcast(self, block):
+        if self.backlog.maxlen:
+            self.backlog.extend(block.splitlines(keepends=True))
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(block)
+
+    async def handle_subscriber(self, reader, writer):
+        name = writer.get_extra_info('peername') or 'unix socket client'
+        subscriber = BoundedQueue(str(name), self.buffer_size, QueuePolicy.DROP_OLDEST)
+        if self.backlog:
+            subscriber.put_nowait(b''.join(self.backlog))
+        self.subscribers.add(subscriber)
+        logger.info(f'{name} subscribed, {len(self.subscribers)} subscribers')
+        try:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(self.forward_messages, subscriber, writer)
+                await reader.read()
+                tg.cancel_scope.cancel()
+        except (ConnectionError, anyio.ExceptionGroup):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+            logger.info(f'{name} unsubscribed, dropped {subscriber.dropped} blocks')
+
+    async def forward_messages(self, subscriber, writer):
+        while True:
+            blocks = [await subscriber.get()]
+            while not subscriber.empty():
+                blocks.append(subscriber.get_nowait())
+            writer.write(b''.join(blocks))
+            await writer.drain()
+
+
+async def relay_upstream(config, relay, status_updates_queue):
+    upstream_queue = asyncio.Queue(maxsize=1)
+    replay_filter = ReplayFilter(config['replay_window']) if config['replay_window'] else None
+    liveness_monitor = LivenessMonitor()
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(log_status_updates, status_updates_queue)
+        tg.start_soon(
+            minechat.keep_connected,
+            config,
+            'Reading',
+            config['reading_timeout'],
+            liveness_monitor,
+            asyncio.Queue(),
+            status_updates_queue,
+            None,
+            partial(minechat.read_messages, timestamped=False),
+            config,
+            None,
+            upstream_queue,
+            status_updates_queue,
+            liveness_monitor,
+            replay_filter
+        )
+        while True:
+            relay.broadcast(await upstream_queue.get())
+
+
+async def log_status_updates(status_updates_queue):
+    while True:
+        logger.info(f'Upstream: {await status_updates_queue.get()}')
+
+
+async def run_relay(config, listen_host, listen_port, socket_path, buffer_size, backlog_size):
+    relay = Relay(buffer_size, backlog_size)
+    servers = []
+    if listen_port:
+        servers.append(await asyncio.start_server(relay.handle_subscriber, listen_host, listen_port))
+        logger.info(f'Relaying to {listen_host}:{listen_port}')
+    if socket_path:
+        with suppress(FileNotFoundError):
+            Path(socket_path).unlink()
+        servers.append(await asyncio.start_unix_server(relay.handle_subscriber, socket_path))
+        logger.info(f'Relaying to {socket_path}')
+
+    try:
+        await relay_upstream(config, relay, BoundedQueue('status_updates', 100, QueuePolicy.DROP_OLDEST))
+    finally:
+        for server in servers:
+            server.close()
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    env = Env()
+    env.read_env()
+
+    parser = argparse.ArgumentParser(description='Share one chat reading connection between local clients')
+    parser.add_argument('--host', '-s', help='Upstream host')
+    parser.add_argument('--readingport', '-rp', type=int, help='Upstream reading port')
+    parser.add_argument('--listenhost', '-lh', help='Host to accept local clients on')
+    parser.add_argument('--listenport', '-lp', type=int, help='Port to accept local clients on, 0 to disable')
+    parser.add_argument('--socket', '-u', help='Unix socket to accept local clients on')
+    args = parser.parse_args()
+
+    config = {
+        'reading_host': args.host or env('HOST', default='minechat.dvmn.org'),
+        'reading_port': args.readingport or env.int('READING_PORT', default=5000),
+        'reconnect_base_delay': env.float('RECONNECT_BASE_DELAY', default=0.5),
+        'reconnect_stable_time': env.float('RECONNECT_STABLE_TIME', default=STABLE_CONNECTION_TIME),
+        'reading_timeout': env.float('READING_TIMEOUT', default=0),
+        'big_reconnect_timeout': env.int('BIG_RECONNECT_TIMEOUT', default=10),
+        'replay_window': env.int('REPLAY_WINDOW', default=1000),
+    }
+    listen_port = args.listenport if args.listenport is not None else env.int('RELAY_PORT', default=5001)
+
+    with suppress(KeyboardInterrupt):
+        asyncio.run(run_relay(
+            config,
+            args.listenhost or env('RELAY_HOST', default='127.0.0.1'),
+            listen_port,
+            args.socket or env('RELAY_SOCKET', default=''),
+            env.int('RELAY_BUFFER_SIZE', default=1000),
+            env.int('RELAY_BACKLOG', default=0)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+from collections import Counter, deque
+
+
+class ReplayFilter:
+    def __init__(self, window=1000):
+        self.fingerprints = deque(maxlen=window)
+        self.counts = Counter()
+        self.replaying = False
+        self.overlapped = False
+
+    def start_replay(self):
+        self.replaying = bool(self.fingerprints)
+        self.overlapped = False
+
+    def remember(self, fingerprint):
+        if len(self.fingerprints) == self.fingerprints.maxlen:
+            oldest = self.fingerprints[0]
+            self.counts[oldest] -= 1
+            if not self.counts[oldest]:
+                del self.counts[oldest]
+        self.fingerprints.append(fingerprint)
+        self.counts[fingerprint] += 1
+
+    def filter(self, lines):
+        new_lines = []
+        gap = False
+        for line in lines:
+            fingerprint = hash(line)
+            if self.replaying:
+                if fingerprint in self.counts:
+                    self.overlapped = True
+                    continue
+                self.replaying = False
+                if not self.overlapped:
+                    gap = True
+            self.remember(fingerprint)
+            new_lines.append(line)
+        return new_lines, gap
@@ -0,0 +1,55 @@
+import argparse
+import time
+from itertools import islice
+
+from environs import Env
+
+from history import HistorySegments
+from history_index import HistoryIndex, make_query
+
+REINDEX_BATCH_SIZE = 10000
+
+
+def reindex(history_file, history_index):
+    history_index.clear()
+    lines = HistorySegments(history_file).iterate_lines()
+    indexed_count = 0
+    while batch := list(islice(lines, REINDEX_BATCH_SIZE)):
+        history_index.add(batch)
+        indexed_count += len(batch)
+    print(f'Проиндексировано строк: {indexed_count}')
+
+
+def main():
+    env = Env()
+    env.read_env()
+
+    parser = argparse.ArgumentParser(description='Search chat history')
+    parser.add_argument('query', nargs='*', help='Words to search')
+    parser.add_argument('--nickname', '-n', help='Search messages of this nickname')
+    parser.add_argument('--limit', '-l', type=int, default=20, help='Max results count')
+    parser.add_argument('--raw', action='store_true', help='Pass query to SQLite FTS5 as is')
+    parser.add_argument('--reindex', action='store_true', help='Rebuild index from history file')
+    parser.add_argument('--historyfile', '-f', help='File for history')
+    args = parser.parse_args()
+
+    history_file = args.historyfile or env('HISTORY_FILE', default='minechat.history')
+    history_index = HistoryIndex(history_file).open()
+
+    if args.reindex:
+        reindex(history_file, history_index)
+    if args.query or args.nickname:
+        text = ' '.join(args.query)
+        query = text if args.raw else make_query(text, args.nickname)
+        started_at = time.perf_counter()
+        results = history_index.search(query, args.limit)
+        elapsed = time.perf_counter() - started_at
+
+        for _, message in reversed(results):
+            print(message)
+        print(f'Найдено: {len(results)} за {elapsed * 1000:.1f} мс')
+    history_index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,28 @@
 import argparse
 import asyncio
-import json
 import logging
+import sys
+from contextlib import suppress
 
-import aiofiles
 from environs import Env
 
-from minechat import get_connection
+from chat_protocol import (
+    Backoff,
+    get_connection,
+    receive_credentials,
+    save_token,
+    sign_in,
+    submit_message,
+    submit_messages,
+    write_to_chat,
+)
+from credentials import DEFAULT_CREDENTIALS_FILE, CredentialsStore
 
 logger = logging.getLogger(__name__)
 
-
-async def receive_credentials(reader):
-    credentials_response = await reader.readline()
-    credentials = json.loads(credentials_response.decode().strip())
-    logger.info(f'Received {credentials}')
-    return credentials
-
-
-async def save_token(nickname, token):
-    async with aiofiles.open(f'{nickname}.token', 'w') as tokenfile:
-        await tokenfile.write(token)
-
-
-async def sign_in(reader, writer, token):
-    logger.info(f'Sending "{token}"')
-    await write_to_chat(writer, f'{token}\n')
-    return await receive_credentials(reader)
+BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 64 * 1024
+RESPONSES_TIMEOUT = 10
 
 
 async def sign_up(reader, writer, nickname, send_blank=False):
@@ -39,33 +35,132 @@ async def sign_up(reader, writer, nickname, send_blank=False):
     return await receive_credentials(reader)
 
 
-async def submit_message(writer, message):
-    message = message.replace('\n', ' ')
-    await write_to_chat(writer, f'{message}\n\n')
+async def authorize(reader, writer, host, token, nickname, credentials_store=None):
+    greeting_query = await reader.readline()
+    logger.info(greeting_query.decode().strip())
+
+    cached_token = None
+    if not token and credentials_store:
+        token = cached_token = credentials_store.find_token(host, nickname)
+    if token:
+        credentials = await sign_in(reader, writer, token)
+        if not credentials:
+            logger.warning('Неизвестный токен. Проверьте его или зарегистрируйте заново.')
+            if cached_token:
+                credentials_store.forget(host, nickname)
+            credentials = await sign_up(reader, writer, nickname)
+    else:
+        credentials = await sign_up(reader, writer, nickname, send_blank=True)
+    if credentials_store and credentials_store.remember(host, credentials):
+        await asyncio.to_thread(credentials_store.save)
+    await save_token(credentials['nickname'], credentials['account_hash'])
+    return credentials
+
 
+async def count_responses(reader, responses):
+    while await reader.readline():
+        responses['count'] += 1
+    raise ConnectionError('Connection closed by server')
 
-async def write_to_chat(writer, message):
-    writer.write(message.encode())
-    await writer.drain()
 
+async def authorize_and_send_messages(
+    message_batches,
+    host,
+    port,
+    token,
+    nickname,
+    credentials_store=None,
+    on_connected=None
+):
+    import anyio
 
-async def authorize_and_send_message(message, host, port, token, nickname):
     async with get_connection(host, port) as (reader, writer):
-        greeting_query = await reader.readline()
-        logger.info(greeting_query.decode().strip())
-
-        if token:
-            credentials = await sign_in(reader, writer, token)
-            if not credentials:
-                logger.warning('Неизвестный токен. Проверьте его или зарегистрируйте заново.')
-                credentials = await sign_up(reader, writer, nickname)
-        else:
-            credentials = await sign_up(reader, writer, nickname, send_blank=True)
-        await save_token(credentials['nickname'], credentials['account_hash'])
-
+        await authorize(reader, writer, host, token, nickname, credentials_store)
+        if on_connected:
+            on_connected()
+        sent_count = 0
+        responses = {'count': 0}
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(count_responses, reader, responses)
+            async for messages in message_batches:
+                await submit_messages(writer, messages)
+                sent_count += len(messages)
+            tg.cancel_scope.cancel()
+
+        with anyio.move_on_after(RESPONSES_TIMEOUT):
+            while responses['count'] < sent_count and await reader.readline():
+                responses['count'] += 1
+        logger.info(f'Sent {sent_count} messages, confirmed {responses["count"]}')
+
+
+async def authorize_and_send_message(message, host, port, token, nickname, credentials_store=None):
+    async with get_connection(host, port) as (reader, writer):
+        await authorize(reader, writer, host, token, nickname, credentials_store)
         await submit_message(writer, message)
 
 
+async def read_file_batches(file):
+    import anyio
+
+    while lines := await anyio.to_thread.run_sync(file.readlines, READ_CHUNK_SIZE):
+        yield [line.rstrip('\n') for line in lines]
+
+
+async def make_single_batch(message):
+    yield [message]
+
+
+async def read_queue_batches(messages_queue, unsent_messages, batch_size=BATCH_SIZE):
+    while True:
+        if not unsent_messages:
+            unsent_messages.append(await messages_queue.get())
+        while len(unsent_messages) < batch_size and not messages_queue.empty():
+            unsent_messages.append(messages_queue.get_nowait())
+        yield list(unsent_messages)
+        unsent_messages.clear()
+
+
+async def serve_socket(socket_path, host, port, token, nickname, credentials_store=None):
+    import anyio
+
+    messages_queue = asyncio.Queue(maxsize=BATCH_SIZE * 10)
+
+    async def receive_messages(reader, writer):
+        while message := await reader.readline():
+            await messages_queue.put(message.decode().rstrip('\n'))
+        writer.close()
+
+    server = await asyncio.start_unix_server(receive_messages, socket_path)
+    logger.info(f'Waiting for messages on {socket_path}')
+    backoff = Backoff()
+    unsent_messages = []
+    async with server:
+        while True:
+            try:
+                await authorize_and_send_messages(
+                    read_queue_batches(messages_queue, unsent_messages),
+                    host,
+                    port,
+                    token,
+                    nickname,
+                    credentials_store,
+                    on_connected=backoff.mark_connected
+                )
+            except (OSError, asyncio.IncompleteReadError, anyio.ExceptionGroup) as error:
+                logger.warning(f'Connection lost: {error!r}, {len(unsent_messages)} messages will be resent')
+            await anyio.sleep(backoff.next_delay())
+
+
+async def hand_over_messages(socket_path, message_batches):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    async for messages in message_batches:
+        lines = (message.replace('\n', ' ') for message in messages)
+        writer.write(''.join(f'{line}\n' for line in lines).encode())
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
 def main():
 
     logging.basicConfig(
@@ -77,22 +172,47 @@ def main():
     env.read_env()
 
     parser = argparse.ArgumentParser(description='Send messages to chat')
-    parser.add_argument('message', nargs='+', help='Message for chat')
+    parser.add_argument('message', nargs='*', help='Message for chat')
     parser.add_argument('--host', '-s', help='Host')
     parser.add_argument('--port', '-p', type=int, help='Port')
     parser.add_argument('--token', '-t', help='Chat token')
     parser.add_argument('--nickname', '-n', help='Chat nickname')
+    parser.add_argument('--file', '-f', help='Send every line of file as a message, "-" for stdin')
+    parser.add_argument('--socket', '-u', help='Unix socket of long-lived sender')
+    parser.add_argument('--serve', action='store_true', help='Run long-lived sender on --socket')
     args = parser.parse_args()
 
     minechat_config = {
-        'message': args.message[0],
         'host': args.host or env('HOST', default='minechat.dvmn.org'),
         'port': args.port or env.int('WRITING_PORT', default=5050),
         'token': args.token or env('CHAT_TOKEN', default=''),
-        'nickname': args.nickname or env('CHAT_NICKNAME', default='')
+        'nickname': args.nickname or env('CHAT_NICKNAME', default=''),
+        'credentials_store': CredentialsStore(env('CREDENTIALS_FILE', default=DEFAULT_CREDENTIALS_FILE)).load()
     }
+    socket_path = args.socket or env('SENDER_SOCKET', default='')
+
+    if args.serve:
+        if not socket_path:
+            parser.error('--serve requires --socket')
+        with suppress(KeyboardInterrupt):
+            asyncio.run(serve_socket(socket_path, **minechat_config))
+        return
+
+    if not args.message and not args.file:
+        parser.error('message or --file is required')
 
-    asyncio.run(authorize_and_send_message(**minechat_config))
+    if not args.file:
+        if socket_path:
+            asyncio.run(hand_over_messages(socket_path, make_single_batch(args.message[0])))
+        else:
+            asyncio.run(authorize_and_send_message(args.message[0], **minechat_config))
+        return
+
+    with (sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')) as file:
+        if socket_path:
+            asyncio.run(hand_over_messages(socket_path, read_file_batches(file)))
+        else:
+            asyncio.run(authorize_and_send_messages(read_file_batches(file), **minechat_config))
 
 
 if __name__ == '__main__':
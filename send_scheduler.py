@@ -0,0 +1,79 @@
+import time
+from collections import deque
+
+import anyio
+
+
+class BulkMessage:
+    def __init__(self, text):
+        self.text = text
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, wanted):
+        self.refill()
+        while self.tokens < 1:
+            await anyio.sleep((1 - self.tokens) / self.rate)
+            self.refill()
+        taken = min(wanted, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+
+class SendScheduler:
+    def __init__(self, sending_queue, rate=5, burst=10):
+        self.sending_queue = sending_queue
+        self.token_bucket = TokenBucket(rate, burst)
+        self.max_batch_size = burst
+        self.user_messages = deque()
+        self.bulk_messages = deque()
+        self.last_latency = 0
+
+    @property
+    def queue_depth(self):
+        return len(self.user_messages) + len(self.bulk_messages) + self.sending_queue.qsize()
+
+    def store(self, message):
+        queued_at = time.monotonic()
+        if isinstance(message, BulkMessage):
+            self.bulk_messages.append((queued_at, message.text))
+        else:
+            self.user_messages.append((queued_at, message))
+
+    def collect(self):
+        max_depth = self.sending_queue.maxsize
+        while not self.sending_queue.empty():
+            if max_depth and len(self.user_messages) + len(self.bulk_messages) >= max_depth:
+                break
+            self.store(self.sending_queue.get_nowait())
+
+    async def next_batch(self):
+        if not self.user_messages and not self.bulk_messages:
+            self.store(await self.sending_queue.get())
+        self.collect()
+
+        wanted = min(self.max_batch_size, len(self.user_messages) + len(self.bulk_messages))
+        allowed = await self.token_bucket.acquire(wanted)
+        self.collect()
+
+        batch = []
+        while len(batch) < allowed and self.user_messages:
+            batch.append(self.user_messages.popleft())
+        while len(batch) < allowed and self.bulk_messages:
+            batch.append(self.bulk_messages.popleft())
+        return batch
+
+    def record_sent(self, batch):
+        sent_at = time.monotonic()
+        self.last_latency = max(sent_at - queued_at for queued_at, _ in batch)
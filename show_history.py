@@ -0,0 +1,50 @@
+import argparse
+import sys
+import time
+
+from environs import Env
+
+from history import HistorySegments
+from history_time_index import TimeIndex, get_time_index_path, parse_datetime
+
+
+def reindex(history_file):
+    segments = HistorySegments(history_file)
+    segment_paths = [segments.filepath.with_name(segment['file']) for segment in segments.load_manifest()]
+    for history_path in [*segment_paths, segments.filepath]:
+        if history_path.suffix in ('.gz', '.xz') or not history_path.exists():
+            continue
+        get_time_index_path(history_path).unlink(missing_ok=True)
+        TimeIndex(history_path).open().close()
+        print(f'Проиндексирован по времени: {history_path}', file=sys.stderr)
+
+
+def main():
+    env = Env()
+    env.read_env()
+
+    parser = argparse.ArgumentParser(description='Print chat history for a time range')
+    parser.add_argument('--since', type=parse_datetime, help='Start of range, e.g. 2024-02-01T14:00')
+    parser.add_argument('--until', type=parse_datetime, help='End of range, not included, e.g. 2024-02-01T15:00')
+    parser.add_argument('--reindex', action='store_true', help='Rebuild time index of history files')
+    parser.add_argument('--historyfile', '-f', help='File for history')
+    args = parser.parse_args()
+
+    history_file = args.historyfile or env('HISTORY_FILE', default='minechat.history')
+    if args.reindex:
+        reindex(history_file)
+        if args.since is None and args.until is None:
+            return
+
+    started_at = time.perf_counter()
+    lines_count = 0
+    for line in HistorySegments(history_file).iterate_range(args.since, args.until):
+        sys.stdout.buffer.write(line)
+        lines_count += 1
+    sys.stdout.buffer.flush()
+    elapsed = time.perf_counter() - started_at
+    print(f'Найдено строк: {lines_count} за {elapsed * 1000:.1f} мс', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import datetime
+import time
+from itertools import islice
+
+from environs import Env
+
+from chat_stats import ChatStats, get_stats_path
+from history import HistorySegments
+from metrics import write_snapshot
+
+REBUILD_BATCH_SIZE = 10000
+
+
+def rebuild(history_file, stats_file):
+    chat_stats = ChatStats(stats_file)
+    lines = HistorySegments(history_file).iterate_raw_lines()
+    while batch := list(islice(lines, REBUILD_BATCH_SIZE)):
+        chat_stats.add(batch)
+    write_snapshot(stats_file, chat_stats.take_snapshot())
+    print(f'Учтено сообщений: {chat_stats.total}')
+
+
+def print_histogram(chat_stats, minutes_count):
+    histogram = chat_stats.get_histogram(minutes_count, chat_stats.last_minute)
+    max_count = max((count for _, count in histogram), default=0) or 1
+    for minute, count in histogram:
+        print(f'{datetime.datetime.fromtimestamp(minute):%d.%m.%y %H:%M} {count:>7} {"#" * (40 * count // max_count)}')
+
+
+def main():
+    env = Env()
+    env.read_env()
+
+    parser = argparse.ArgumentParser(description='Show chat activity statistics')
+    parser.add_argument('nicknames', nargs='*', help='Show message counts of these nicknames')
+    parser.add_argument('--top', '-t', type=int, default=10, help='Most active nicknames count')
+    parser.add_argument('--minutes', '-m', type=int, default=0, help='Show messages per minute for last minutes')
+    parser.add_argument('--days', '-d', action='store_true', help='Show messages per day')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild statistics from history file')
+    parser.add_argument('--historyfile', '-f', help='File for history')
+    parser.add_argument('--statsfile', help='File for statistics, <historyfile>.stats.json by default')
+    args = parser.parse_args()
+
+    history_file = args.historyfile or env('HISTORY_FILE', default='minechat.history')
+    stats_file = args.statsfile or env('CHAT_STATS_FILE', default='') or get_stats_path(history_file)
+
+    if args.rebuild:
+        rebuild(history_file, stats_file)
+
+    started_at = time.perf_counter()
+    chat_stats = ChatStats(stats_file).load()
+    print(f'Всего сообщений: {chat_stats.total}')
+    print('Активнее всех:')
+    for nickname, count in chat_stats.get_top(args.top):
+        print(f'{count:>10} {nickname}')
+    for nickname in args.nicknames:
+        print(f'{nickname}: около {chat_stats.count(nickname)} сообщений')
+    if args.days:
+        for day, count in sorted(chat_stats.days.items()):
+            print(f'{day} {count:>10}')
+    if args.minutes:
+        print_histogram(chat_stats, args.minutes)
+    print(f'Отчёт построен за {(time.perf_counter() - started_at) * 1000:.1f} мс')
+
+
+if __name__ == '__main__':
+    main()